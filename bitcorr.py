@@ -0,0 +1,102 @@
+import argparse, sys, time
+import numpy as np
+
+import corpus
+import decode_ic
+import packettable
+
+#Which bits of the decoded iC words go with the shotSizeA / wasHitA notes.
+#Each record gives one row of features, the 16 bits of the word at each packet
+#position of each channel (missing where that packet didn't decode), and one row
+#of labels, one per turn (character) of each note ("?" is missing). Mutual
+#information between every feature and every label comes from a few matrix
+#products of indicator matrices, so the cost doesn't depend on looping over pairs.
+
+LABELS = ["shotSizeA", "wasHitA", "shotSizeB", "wasHitB"]
+MAX_PACKETS = 16
+MIN_PAIRS = 8       #records that must have both the bit and the label
+
+#features: records x (channel, packet, bit) with 1, 0 or -1 for missing
+def bitMatrix(table, recordCount):
+    good = table.where((table["status"] <= decode_ic.STATUS_AUTOFIX) & (table["packet"] < MAX_PACKETS))
+    columns = (good["channel"].astype(np.int64) * MAX_PACKETS + good["packet"]) * 16
+    bits = (good["data"][:, None] >> np.arange(16)) & 1
+    matrix = np.full((recordCount, 2 * MAX_PACKETS * 16), -1, dtype=np.int8)
+    matrix[good["record"][:, None], columns[:, None] + np.arange(16)] = bits
+    names = ["%s%d bit %d" % (channel, packet + 1, bit) for channel in "AB" for packet in range(MAX_PACKETS) for bit in range(16)]
+    return matrix, names
+
+#labels one-hot: records x (note, turn, value) of 0/1, with the (note, turn)
+#group of each column, and the group names
+def labelMatrix(records):
+    values = {}
+    for item in records:
+        for label in LABELS:
+            for turn, char in enumerate(item.get(label) or ""):
+                if char != "?":
+                    values.setdefault((label, turn), set()).add(char)
+    groups = sorted(values)
+    columns = [(group, value) for group in groups for value in sorted(values[group])]
+    position = {column: i for i, column in enumerate(columns)}
+    matrix = np.zeros((len(records), len(columns)), dtype=np.float64)
+    for row, item in enumerate(records):
+        for label in LABELS:
+            for turn, char in enumerate(item.get(label) or ""):
+                if char != "?":
+                    matrix[row, position[((label, turn), char)]] = 1
+    groupOf = np.array([groups.index(group) for group, _ in columns], dtype=np.int64)
+    names = ["%s[%d]" % (label, turn + 1) for label, turn in groups]
+    return matrix, groupOf, names
+
+#Mutual information in bits, features x label groups, plus the label entropy
+#(over the same records) and the number of records with both.
+def mutualInformation(bits, labels, groupOf):
+    ones = (bits == 1).astype(np.float64)
+    zeros = (bits == 0).astype(np.float64)
+    groupIndicator = np.zeros((labels.shape[1], groupOf.max() + 1 if len(groupOf) > 0 else 0))
+    groupIndicator[np.arange(len(groupOf)), groupOf] = 1
+    #counts of (bit value, label value) over records that have both
+    n1v = ones.T @ labels
+    n0v = zeros.T @ labels
+    nv = n1v + n0v
+    n = nv @ groupIndicator
+    n1 = n1v @ groupIndicator
+    n0 = n0v @ groupIndicator
+    nExpanded = n[:, groupOf]
+    def term(nxv, nx):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = nxv / nExpanded * np.log2(nxv * nExpanded / (nx[:, groupOf] * nv))
+        return np.nan_to_num(t)
+    mi = (term(n1v, n1) + term(n0v, n0)) @ groupIndicator
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pv = nv / nExpanded
+        entropy = np.nan_to_num(-pv * np.log2(pv)) @ groupIndicator
+    return mi, entropy, n
+
+def analyse(records):
+    records = [item for item in records if item.get("decode") in ["ic", "ics"] and any(label in item for label in LABELS)]
+    table = packettable.decodeRecords(records)
+    bits, bitNames = bitMatrix(table, len(records))
+    labels, groupOf, labelNames = labelMatrix(records)
+    mi, entropy, n = mutualInformation(bits, labels, groupOf)
+    return mi, entropy, n, bitNames, labelNames, len(records)
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Rank decoded bits by how much they tell about the shot size / hit notes.")
+    argParser.add_argument("--corpus", default=corpus.CORPUS_PATH)
+    argParser.add_argument("--top", type=int, default=40)
+    argParser.add_argument("--min-pairs", type=int, default=MIN_PAIRS)
+    args = argParser.parse_args()
+    timeStart = time.monotonic()
+    mi, entropy, n, bitNames, labelNames, recordCount = analyse(corpus.openCorpus(args.corpus).records())
+    #share of the label's uncertainty explained by the bit: 1 means the bit gives the label
+    with np.errstate(divide="ignore", invalid="ignore"):
+        explained = np.where(entropy > 0, mi / entropy, 0)
+    explained[n < args.min_pairs] = 0
+    order = np.argsort(-explained, axis=None)[:args.top]
+    print("label", "bit", "explained", "MI bits", "records", sep="\t")
+    for feature, group in zip(*np.unravel_index(order, explained.shape)):
+        if explained[feature, group] <= 0:
+            break
+        print(labelNames[group], bitNames[feature], "%.2f" % explained[feature, group], "%.3f" % mi[feature, group], int(n[feature, group]), sep="\t")
+    print("%d records, %d bits x %d labels in %.3f s" % (recordCount, len(bitNames), len(labelNames), time.monotonic() - timeStart), file=sys.stderr)
@@ -0,0 +1,413 @@
+import argparse, array, ast, bisect, collections, random, sys, time, types
+
+import piosim
+
+#Runs doComm from pycomm/code.py on the host, for two virtual devices facing
+#each other, so the receive logic can be tried against many sequences, timeouts
+#and noise settings without a board.
+#Each device gets its own copy of the code, with virtual time and hardware:
+#  time.sleep advances the device's clock; time.monotonic_ns and an empty running
+#  PulseIn are polling, which advance it a step (or to the next incoming edge)
+#  PulseOut.send and the iC state machine (through piosim) put edges on the channel
+#  PulseIn records the other device's edges as CircuitPython would
+#Only one device runs at a time: the one that is furthest behind in virtual
+#time, so nothing can reach a device from its past. To switch between them
+#cheaply, the functions of code.py are turned into generators as they are
+#loaded: calls to them, to time.*, to len() (an empty PulseIn) and to the
+#senders become "yield from", and the waits at the bottom yield to Simulation.
+#Supports the modulated (Data Link, Fusion) and iC / XrosLink types; the others
+#read their input through PIO programs or the prongs.
+
+CODE_PATH = "pycomm/code.py"
+POLL_STEP = 1_000_000       #ns; how late a busy-wait can notice its timeout
+TIME_LIMIT = 60_000_000_000 #ns; stops exchanges where both sides wait forever
+PULSE_MAX = 65535           #PulseIn durations are 16-bit
+
+#comm types as numbered in code.py
+TYPE_DATALINK = 0
+TYPE_FUSION = 1
+TYPE_IC = 2
+TYPE_XROSLINK = 4
+
+SENDERS = ["send", "write"]   #PulseOut.send, StateMachine.write
+
+#Makes the functions of code.py (not the methods of its classes, which don't
+#wait) generators, with the calls that can wait as "yield from".
+class Generators(ast.NodeTransformer):
+    def __init__(self, functions):
+        self.functions = functions
+    def visit_ClassDef(self, node):
+        return node
+    def visit_FunctionDef(self, node):
+        self.generic_visit(node)
+        #a generator even if nothing in it waits, since it is called with yield from
+        node.body.insert(0, ast.If(test=ast.Constant(False), body=[ast.Expr(ast.Yield())], orelse=[]))
+        return node
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        f = node.func
+        if isinstance(f, ast.Name) and f.id == "len":
+            node.func = ast.Name("pollingLen", ast.Load())
+        elif not ((isinstance(f, ast.Name) and f.id in self.functions)
+                or (isinstance(f, ast.Attribute) and (f.attr in SENDERS or (isinstance(f.value, ast.Name) and f.value.id == "time")))):
+            return node
+        return ast.YieldFrom(node)
+
+#top-level definitions of code.py, without the imports, hardware setup and main loop
+def loadCode(path=CODE_PATH):
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    body = [node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.ClassDef, ast.Assign))]
+    #top-level functions and the ones defined inside them, like doComm's sendPacket
+    functions = {f.name for node in body if isinstance(node, ast.FunctionDef) for f in ast.walk(node) if isinstance(f, ast.FunctionDef)}
+    module = Generators(functions).visit(ast.Module(body=body, type_ignores=[]))
+    return compile(ast.fix_missing_locations(module), path, "exec")
+
+class SimulationEnded(BaseException):
+    pass
+
+#Adds jitter and loss on the way from one device to the other.
+#Jitter only delays edges, so an edge never arrives before it was sent.
+class Channel:
+    def __init__(self, delay=0, jitter=0, pulseLoss=0.0, packetLoss=0.0):
+        self.delay = delay
+        self.jitter = jitter
+        self.pulseLoss = pulseLoss
+        self.packetLoss = packetLoss
+    #edges are (ns, IR on) pairs, starting with an on
+    def carry(self, edges, rng):
+        if self.packetLoss > 0 and rng.random() < self.packetLoss:
+            return []
+        if self.pulseLoss > 0:
+            kept = []
+            for i in range(0, len(edges), 2):
+                if rng.random() >= self.pulseLoss:
+                    kept.extend(edges[i:i+2])
+            edges = kept
+        result = []
+        previous = -1
+        for t, on in edges:
+            t += self.delay * 1000
+            if self.jitter > 0:
+                t += int(rng.uniform(0, self.jitter * 1000))
+            t = max(t, previous + 1)
+            result.append((t, on))
+            previous = t
+        return result
+
+class PulseIn:
+    def __init__(self, device, pin, maxlen=2, idle_state=False):
+        self.device = device
+        self.maxlen = maxlen
+        self.idleState = idle_state
+        self.level = idle_state
+        self.durations = collections.deque()
+        self.paused = False
+        self.lastEdge = None
+        self.cursor = bisect.bisect_right(device.incomingTimes, device.now)
+        device.pulseIn = self
+    #take in the edges that have arrived by now
+    def update(self):
+        device = self.device
+        times = device.incomingTimes
+        if self.cursor == len(times) or times[self.cursor] > device.now:
+            return
+        while self.cursor < len(device.incoming) and device.incoming[self.cursor][0] <= device.now:
+            t, on = device.incoming[self.cursor]
+            self.cursor += 1
+            level = not on  #the receivers are active low
+            if level == self.level:
+                continue
+            self.level = level
+            if self.paused:
+                continue
+            if self.lastEdge is None:
+                if level != self.idleState:
+                    self.lastEdge = t
+                continue
+            if len(self.durations) < self.maxlen:
+                self.durations.append(min((t - self.lastEdge) // 1000, PULSE_MAX))
+            self.lastEdge = t
+    def waiting(self):
+        return not self.paused and len(self.durations) == 0
+    def length(self):
+        self.update()
+        if not self.paused and len(self.durations) == 0:
+            #busy-waiting for the first pulse
+            yield from self.device.block()
+            self.update()
+        return len(self.durations)
+    def clear(self):
+        self.update()
+        self.durations.clear()
+    def pause(self):
+        self.update()
+        self.paused = True
+    def resume(self):
+        self.update()
+        self.paused = False
+        self.lastEdge = None
+    def popleft(self):
+        self.update()
+        return self.durations.popleft()
+    def deinit(self):
+        if self.device.pulseIn is self:
+            self.device.pulseIn = None
+
+class PulseOut:
+    def __init__(self, device, pin, frequency=38000, duty_cycle=0):
+        self.device = device
+    #blocks until sent, as in CircuitPython
+    def send(self, pulses):
+        return self.device.transmit(list(pulses))
+    def deinit(self):
+        pass
+
+class StateMachine:
+    def __init__(self, device, program, frequency, **kwargs):
+        self.device = device
+        self.program = program
+        self.frequency = frequency
+    #returns when the waveform has gone out (the real FIFO lets it return a few bytes early)
+    def write(self, data):
+        key = (self.program, self.frequency, bytes(data))
+        cache = self.device.simulation.waveforms
+        if key not in cache:
+            sm = piosim.StateMachine(self.program, self.frequency)
+            sm.write(list(data))
+            cache[key] = sm.run()[1:]
+        return self.device.transmit(cache[key])
+    def deinit(self):
+        pass
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = None
+        self.value = False
+    def deinit(self):
+        pass
+
+#len() in the converted code: an empty PulseIn is how it waits for a packet
+def pollingLen(x):
+    if isinstance(x, PulseIn):
+        return (yield from x.length())
+    return len(x)
+
+class Pins:
+    def __getattr__(self, name):
+        return name
+
+#Kept for the next run of the same Simulation, like a board running doComm
+#again from its main loop: only the clock, the channel and the output start over.
+class Device:
+    def __init__(self, simulation, name, code, params=None):
+        self.simulation = simulation
+        self.name = name
+        self.reset()
+        self.namespace = {
+            "__name__": "pycomm",
+            "pollingLen": pollingLen,
+            "array": array,
+            "board": Pins(),
+            "print": self.print,
+            "time": types.SimpleNamespace(monotonic_ns=self.monotonic_ns, monotonic=self.monotonic, sleep=self.sleep),
+            "digitalio": types.SimpleNamespace(DigitalInOut=DigitalInOut, Direction=types.SimpleNamespace(INPUT="input", OUTPUT="output")),
+            "pulseio": types.SimpleNamespace(
+                PulseIn=lambda *args, **kwargs: PulseIn(self, *args, **kwargs),
+                PulseOut=lambda *args, **kwargs: PulseOut(self, *args, **kwargs),
+            ),
+            "pwmio": types.SimpleNamespace(),
+            "rp2pio": types.SimpleNamespace(StateMachine=lambda *args, **kwargs: StateMachine(self, *args, **kwargs)),
+            "adafruit_pioasm": types.SimpleNamespace(assemble=lambda text: text),
+        }
+        exec(code, self.namespace)
+        if params:
+            baseParams = self.namespace["Params"]
+            class Params(baseParams):
+                def __init__(self, commType):
+                    baseParams.__init__(self, commType)
+                    for key, value in params.items():
+                        setattr(self, key, value)
+            self.namespace["Params"] = Params
+    def reset(self):
+        self.now = 0
+        self.until = 0
+        self.done = False
+        self.incoming = []
+        self.incomingTimes = []
+        self.pulseIn = None
+        self.text = []
+    def print(self, *args, sep=" ", end="\n", **kwargs):
+        self.text.append(sep.join(str(x) for x in args) + end)
+    def lines(self):
+        return "".join(self.text).splitlines()
+    def monotonic_ns(self):
+        yield from self.block()
+        return self.now
+    def monotonic(self):
+        return (yield from self.monotonic_ns()) / 1e9
+    def sleep(self, seconds):
+        yield from self.block(self.now + round(seconds * 1e9))
+    #time the device will next be run at: when its sleep ends, or if it's
+    #polling, a step later or when the next edge arrives while it waits for one
+    def nextTime(self):
+        if self.until is not None:
+            return self.until
+        t = self.now + self.simulation.pollStep
+        if self.pulseIn is not None and self.pulseIn.waiting():
+            i = bisect.bisect_right(self.incomingTimes, self.now)
+            if i < len(self.incomingTimes):
+                t = min(t, self.incomingTimes[i])
+        return t
+    #give way to the other device; until is None for polling. Only goes back to
+    #Simulation.run if another device is next (or the time is up), since most
+    #polls are followed by another poll of the same device.
+    def block(self, until=None):
+        self.until = until
+        simulation = self.simulation
+        simulation.current = simulation.switch()
+        if simulation.current is not self:
+            yield
+    def transmit(self, durations):
+        #durations alternate on and off, starting with on; a final off is just waiting.
+        #The first edge is just after now, so a device that is at the same time but
+        #runs later still sets up its input before the edge arrives.
+        t = self.now + 1
+        edges = [(t, True)]
+        for i, duration in enumerate(durations):
+            t += duration * 1000
+            if i % 2 == 0:
+                edges.append((t, False))
+            elif i < len(durations) - 1:
+                edges.append((t, True))
+        self.simulation.send(self, edges)
+        yield from self.block(t)
+    def receive(self, edges):
+        if len(edges) == 0:
+            return
+        self.incoming.extend(edges)
+        if len(self.incoming) > len(edges) and self.incoming[-len(edges) - 1][0] > edges[0][0]:
+            self.incoming.sort()
+            self.incomingTimes = [t for t, _ in self.incoming]
+        else:
+            self.incomingTimes.extend(t for t, _ in edges)
+    def run(self, sequence, printLog):
+        try:
+            yield from self.namespace["doComm"](sequence, printLog)
+        except SimulationEnded:
+            self.print("(time limit)")
+        except Exception as e:
+            self.print("exception: %r" % e)
+
+class Simulation:
+    def __init__(self, code=None, channel=None, seed=0, pollStep=POLL_STEP, timeLimit=TIME_LIMIT):
+        self.code = code if code is not None else loadCode()
+        self.channel = channel if channel is not None else Channel()
+        self.rng = random.Random(seed)
+        self.pollStep = pollStep
+        self.timeLimit = timeLimit
+        self.waveforms = {}
+        self.devices = []
+        self.deviceParams = None
+        self.current = None
+    def send(self, sender, edges):
+        for device in self.devices:
+            if device is not sender:
+                device.receive(self.channel.carry(edges, self.rng))
+    #the device to run next: whichever is furthest behind; None when all are
+    #done, or past the time limit
+    def switch(self):
+        best = None
+        for device in self.devices:
+            if not device.done:
+                t = device.nextTime()
+                if best is None or t < bestTime:
+                    best, bestTime = device, t
+        if best is None:
+            return None
+        if bestTime > self.timeLimit:
+            return None
+        best.now = max(best.now, bestTime)
+        best.until = None
+        return best
+    #sequences and params are per device; returns each device's printed lines
+    #and the virtual time at the end, in seconds
+    def run(self, sequences, params=None, printLog=False):
+        for sequence in sequences:
+            if sequence[0] not in [TYPE_DATALINK, TYPE_FUSION, TYPE_IC, TYPE_XROSLINK]:
+                raise ValueError("can't simulate comm type %d" % sequence[0])
+        if len(self.devices) != len(sequences) or self.deviceParams != params:
+            self.devices = [Device(self, name, self.code, params[i] if params else None) for i, name in enumerate("AB"[:len(sequences)])]
+            self.deviceParams = params
+        for device, sequence in zip(self.devices, sequences):
+            device.reset()
+            device.runner = device.run(sequence, printLog)
+        self.current = self.switch()
+        while self.current is not None:
+            device = self.current
+            try:
+                #until it blocks and another device is next
+                next(device.runner)
+            except StopIteration:
+                device.done = True
+                self.current = self.switch()
+        #past the time limit: stop the ones still waiting
+        for device in self.devices:
+            if not device.done:
+                device.done = True
+                try:
+                    device.runner.throw(SimulationEnded())
+                except (StopIteration, SimulationEnded):
+                    pass
+        return [device.lines() for device in self.devices], max(device.now for device in self.devices) / 1e9
+
+def sequenceNames(code):
+    namespace = Device(Simulation(code), "", code).namespace
+    return {name: value for name, value in namespace.items() if isinstance(value, list) and len(value) >= 2 and isinstance(value[1], bool)}
+
+#"A.replyTimeout_ms=50" -> (0, "replyTimeout_ms", 50)
+def parseSetting(text):
+    side, _, rest = text.partition(".")
+    name, _, value = rest.partition("=")
+    return "AB".index(side), name, float(value) if "." in value else int(value)
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Simulate a doComm exchange between two virtual devices.")
+    argParser.add_argument("sequenceA", help="sequence name from pycomm/code.py, e.g. datalinkGive10Pt1st")
+    argParser.add_argument("sequenceB")
+    argParser.add_argument("--delay", type=int, default=0, help="microseconds from one device to the other")
+    argParser.add_argument("--jitter", type=int, default=0, help="up to this many microseconds added to each edge")
+    argParser.add_argument("--pulse-loss", type=float, default=0.0)
+    argParser.add_argument("--packet-loss", type=float, default=0.0)
+    argParser.add_argument("--poll-step", type=int, default=POLL_STEP // 1000, help="microseconds")
+    argParser.add_argument("--set", action="append", default=[], metavar="SIDE.PARAM=VALUE", help="override a Params field, e.g. A.replyTimeout_ms=50")
+    argParser.add_argument("--runs", type=int, default=1, help="run with this many seeds and count the outcomes")
+    argParser.add_argument("--seed", type=int, default=0)
+    argParser.add_argument("--log", action="store_true", help="print each side's logBuffer")
+    args = argParser.parse_args()
+    code = loadCode()
+    names = sequenceNames(code)
+    sequences = [names[args.sequenceA], names[args.sequenceB]]
+    params = [{}, {}]
+    for setting in args.set:
+        side, name, value = parseSetting(setting)
+        params[side][name] = value
+    channel = Channel(args.delay, args.jitter, args.pulse_loss, args.packet_loss)
+    outcomes = collections.Counter()
+    virtualTime = 0
+    timeStart = time.monotonic()
+    simulation = Simulation(code, channel, pollStep=args.poll_step * 1000)
+    for run in range(args.runs):
+        simulation.rng.seed(args.seed + run)
+        lines, endTime = simulation.run(sequences, params, args.log)
+        virtualTime += endTime
+        outcomes[tuple(tuple(x) for x in lines)] += 1
+    elapsed = time.monotonic() - timeStart
+    for outcome, count in outcomes.most_common():
+        if args.runs > 1:
+            print("%d runs:" % count)
+        for side, lines in zip("AB", outcome):
+            for line in lines:
+                print("%s: %s" % (side, line))
+    print("%d runs, %.1f s simulated in %.2f s" % (args.runs, virtualTime, elapsed), file=sys.stderr)
@@ -0,0 +1,277 @@
+import fcntl, json, os, sys, tempfile, time
+
+#Reading and appending to irdata.json without disturbing its layout:
+#one record per block, one key per line, arrays without spaces, as the
+#capture boards print them.
+#
+#A corpus can also be a directory of segments (see SegmentStore below), for when
+#several processes capture and analyse at once, or a packed .npz file (see
+#packdur.py). openCorpus accepts any of them.
+
+CORPUS_PATH = "irdata.json"
+
+def loadRecords(path=CORPUS_PATH):
+    with open(path) as f:
+        return json.load(f)["data"]
+
+def formatRecord(item):
+    lines = []
+    for key, value in item.items():
+        if isinstance(value, list):
+            valueStr = json.dumps(value, separators=(",", ":"))
+        else:
+            valueStr = json.dumps(value)
+        lines.append("%s: %s" % (json.dumps(key), valueStr))
+    return "{" + ",\n".join(lines) + "\n}"
+
+#Add records at the end of the data list, touching only the tail of the file.
+def appendRecords(items, path=CORPUS_PATH):
+    if len(items) == 0:
+        return
+    text = ",\n\n".join(formatRecord(item) for item in items)
+    with open(path, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        tailSize = min(size, 4096)
+        f.seek(size - tailSize)
+        tail = f.read(tailSize)
+        closing = tail.rindex(b"]")
+        before = tail[:closing].rstrip()
+        if before.endswith(b"}"):
+            #after the last record
+            position = size - tailSize + len(before)
+            text = ",\n\n" + text
+        elif before.endswith(b"["):
+            position = size - tailSize + len(before)
+            text = "\n\n" + text
+        else:
+            raise ValueError("unexpected end of " + path)
+        f.seek(position)
+        f.write((text + "\n\n]}\n").encode())
+        f.truncate()
+
+def appendRecord(item, path=CORPUS_PATH):
+    appendRecords([item], path)
+
+def formatFile(items):
+    return "{\"data\": [\n\n" + ",\n\n".join(formatRecord(item) for item in items) + "\n\n]}\n"
+
+def currentUmask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+#write a whole file (text or bytes) so that readers see either the old or the new version
+def writeAtomic(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tempPath = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        #mkstemp makes it private; give it the mode of the file it replaces, or the usual one
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~currentUmask()
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, "wb" if isinstance(text, bytes) else "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempPath, path)
+    except BaseException:
+        os.unlink(tempPath)
+        raise
+
+#Caches of what the tools work out from a corpus are kept next to it: ".NAME.SUFFIX"
+#beside a file, SUFFIX inside a store. They are checked against corpusVersion,
+#which changes whenever records are added (for a store, the manifest is
+#rewritten); tag is the cache format's own version.
+def sidecarPath(path, suffix):
+    if os.path.isdir(path):
+        return os.path.join(path, suffix)
+    directory, name = os.path.split(path)
+    return os.path.join(directory, "." + name + "." + suffix)
+
+def corpusVersion(path, tag=None):
+    if os.path.isdir(path):
+        path = os.path.join(path, "manifest.json")
+    stat = os.stat(path)
+    return [tag, stat.st_size, stat.st_mtime_ns]
+
+def writeCache(path, data):
+    try:
+        writeAtomic(path, data)
+    except OSError:
+        #read-only corpus: works, just without the cache
+        pass
+
+class JsonFile:
+    def __init__(self, path):
+        self.path = path
+    def records(self):
+        return iter(loadRecords(self.path))
+    def appendRecords(self, items):
+        appendRecords(items, self.path)
+    def export(self, path):
+        writeAtomic(path, formatFile(loadRecords(self.path)))
+
+#Append-only store: immutable segment files, each in the irdata.json format, plus
+#manifest.json listing them in order. Adding records writes one new segment and
+#rewrites only the small manifest. compact() merges runs of small segments and
+#resolves duplicate ids; replaced segments are kept for a while so that readers
+#part-way through an old manifest can finish.
+class SegmentStore:
+    SMALL_SEGMENT = 256 * 1024
+    RETIRE_SECONDS = 600
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifestPath = os.path.join(directory, "manifest.json")
+        if not os.path.exists(self.manifestPath):
+            with self.lock():
+                if not os.path.exists(self.manifestPath):
+                    self.writeManifest({"next": 1, "segments": [], "retired": []})
+    def lock(self):
+        return _Lock(os.path.join(self.directory, "lock"))
+    def readManifest(self):
+        with open(self.manifestPath) as f:
+            return json.load(f)
+    def writeManifest(self, manifest):
+        writeAtomic(self.manifestPath, json.dumps(manifest, indent=1) + "\n")
+    def segmentPath(self, name):
+        return os.path.join(self.directory, name)
+    def segmentName(self, manifest):
+        name = "segment-%06d.json" % manifest["next"]
+        manifest["next"] += 1
+        return name
+    def segments(self):
+        return self.readManifest()["segments"]
+    #records in order, reading one segment at a time
+    def records(self):
+        for segment in self.segments():
+            with open(self.segmentPath(segment["name"])) as f:
+                yield from json.load(f)["data"]
+    def ids(self):
+        return (item["id"] for item in self.records())
+    def writeSegment(self, items, manifest):
+        name = self.segmentName(manifest)
+        text = formatFile(items)
+        writeAtomic(self.segmentPath(name), text)
+        return {"name": name, "count": len(items), "size": len(text)}
+    def appendRecords(self, items):
+        if len(items) == 0:
+            return
+        with self.lock():
+            manifest = self.readManifest()
+            manifest["segments"].append(self.writeSegment(items, manifest))
+            self.writeManifest(manifest)
+    #Runs alongside writers: the merging is done from a snapshot of the manifest,
+    #and only the swap at the end takes the write lock. Segments appended in the
+    #meantime are left as they are.
+    def compact(self):
+        with _Lock(os.path.join(self.directory, "compact.lock")):
+            snapshot = self.readManifest()["segments"]
+            seen = {}
+            newSegments = []
+            retired = []
+            run = []
+            def flushRun():
+                if len(run) > 1 or any(changed for _, changed, _ in run):
+                    items = [item for _, _, resolved in run for item in resolved]
+                    #a run of nothing but duplicates just goes
+                    if len(items) > 0:
+                        #numbered like appended segments, so the name doesn't grow with each compaction
+                        with self.lock():
+                            manifest = self.readManifest()
+                            name = self.segmentName(manifest)
+                            self.writeManifest(manifest)
+                        text = formatFile(items)
+                        writeAtomic(self.segmentPath(name), text)
+                        newSegments.append({"name": name, "count": len(items), "size": len(text)})
+                    retired.extend(segment["name"] for segment, _, _ in run)
+                elif len(run) == 1:
+                    newSegments.append(run[0][0])
+                run.clear()
+            for segment in snapshot:
+                with open(self.segmentPath(segment["name"])) as f:
+                    items = json.load(f)["data"]
+                resolved, changed = resolveDuplicates(items, seen)
+                if segment["size"] < self.SMALL_SEGMENT or changed:
+                    run.append((segment, changed, resolved))
+                else:
+                    flushRun()
+                    newSegments.append(segment)
+            flushRun()
+            with self.lock():
+                manifest = self.readManifest()
+                if manifest["segments"][:len(snapshot)] != snapshot:
+                    raise RuntimeError("manifest changed under compaction")
+                manifest["segments"] = newSegments + manifest["segments"][len(snapshot):]
+                manifest["retired"].extend({"name": name, "time": time.time()} for name in retired)
+                self.deleteRetired(manifest)
+                self.writeManifest(manifest)
+    def deleteRetired(self, manifest):
+        keep = []
+        for retired in manifest["retired"]:
+            if time.time() - retired["time"] > self.RETIRE_SECONDS:
+                try:
+                    os.unlink(self.segmentPath(retired["name"]))
+                except FileNotFoundError:
+                    pass
+            else:
+                keep.append(retired)
+        manifest["retired"] = keep
+    def export(self, path):
+        writeAtomic(path, formatFile(list(self.records())))
+
+#Drop exact repeats of a record already seen, and rename a different record
+#reusing an id (index.html can only show the first one), e.g. "wha-lila-1~2".
+def resolveDuplicates(items, seen):
+    result = []
+    changed = False
+    for item in items:
+        itemId = item["id"]
+        if itemId in seen:
+            if item in seen[itemId]:
+                changed = True
+                continue
+            seen[itemId].append(item)
+            number = len(seen[itemId])
+            while "%s~%d" % (itemId, number) in seen:
+                number += 1
+            item = dict(item, id="%s~%d" % (itemId, number))
+            #so that a later record with this id is renamed in turn
+            seen[item["id"]] = [item]
+            changed = True
+        else:
+            seen[itemId] = [item]
+        result.append(item)
+    return result, changed
+
+class _Lock:
+    def __init__(self, path):
+        self.path = path
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+    def __exit__(self, *args):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+def openCorpus(path=CORPUS_PATH):
+    if os.path.isdir(path):
+        return SegmentStore(path)
+    if path.endswith(".npz"):
+        import packdur
+        return packdur.PackedFile(path)
+    return JsonFile(path)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "import":
+        SegmentStore(sys.argv[3]).appendRecords(loadRecords(sys.argv[2]))
+    elif len(sys.argv) == 4 and sys.argv[1] == "export":
+        openCorpus(sys.argv[2]).export(sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "compact":
+        SegmentStore(sys.argv[2]).compact()
+    else:
+        print("import irdata.json STORE / export STORE irdata.json / compact STORE")
@@ -0,0 +1,122 @@
+import json, sys, time
+import numpy as np
+
+#Crossover removal for two-channel captures from twinscope.ino .
+#Each channel is a list of falling-edge intervals; A[0] is the trigger (0) and
+#B[0] is the time from the trigger to B's first edge, so cumulative sums give
+#edge times on a common clock. Each sensor also picks up the other device,
+#so an edge seen on both channels belongs to whichever device is sending at the time.
+
+RESOLUTION = 8      #histogram bin width for alignment, microseconds
+MAX_OFFSET = 400    #largest sensor-to-sensor offset we look for
+TOLERANCE = 24      #how close two edges must be after alignment to be the same event
+WINDOW = 2000       #gap that ends a run of crossover edges
+MIN_MATCHES = 16    #fewer coincidences than this are treated as chance, not crossover
+
+def edgeTimes(durations):
+    return np.cumsum(np.asarray(durations, dtype=np.int64))
+
+#offset to add to B's edge times to line them up with A, by FFT cross-correlation,
+#or None if the channels have too little in common
+def estimateOffset(timesA, timesB):
+    if len(timesA) == 0 or len(timesB) == 0:
+        return None
+    start = min(timesA[0], timesB[0])
+    binsA = (timesA - start) // RESOLUTION
+    binsB = (timesB - start) // RESOLUTION
+    maxBins = MAX_OFFSET // RESOLUTION
+    n = 1
+    while n < max(binsA[-1], binsB[-1]) + 2 * maxBins + 2:
+        n <<= 1
+    histA = np.bincount(binsA, minlength=n).astype(np.float64)
+    histB = np.bincount(binsB, minlength=n).astype(np.float64)
+    corr = np.fft.irfft(np.fft.rfft(histA) * np.conj(np.fft.rfft(histB)), n)
+    #corr[k] counts A edges k bins after B edges; negative k wraps around
+    lags = np.arange(-maxBins, maxBins + 1)
+    window = corr[lags % n]
+    #jitter spreads a match over neighbouring bins
+    smoothed = window + np.roll(window, 1) + np.roll(window, -1)
+    smoothed[[0, -1]] = window[[0, -1]]
+    best = np.argmax(smoothed)
+    if smoothed[best] < MIN_MATCHES:
+        return None
+    return int(lags[best] * RESOLUTION)
+
+#for each edge in "times", whether an edge in "other" is within TOLERANCE
+def matchEdges(times, other):
+    if len(other) == 0:
+        return np.zeros(len(times), dtype=bool)
+    i = np.searchsorted(other, times)
+    before = other[np.maximum(i - 1, 0)]
+    after = other[np.minimum(i, len(other) - 1)]
+    nearest = np.minimum(np.abs(times - before), np.abs(times - after))
+    return nearest <= TOLERANCE
+
+#number of "times" strictly between each pair of "lo" and "hi"
+def countBetween(times, lo, hi):
+    return np.maximum(np.searchsorted(times, hi) - np.searchsorted(times, lo, side="right"), 0)
+
+#Group the matched edges into runs (breaking at gaps over WINDOW, so roughly
+#one run per packet) and return each matched edge's run start and end times.
+def matchedRuns(matchedTimes):
+    if len(matchedTimes) == 0:
+        return matchedTimes, matchedTimes
+    run = np.r_[0, np.cumsum(np.diff(matchedTimes) > WINDOW)]
+    firsts = np.r_[0, np.flatnonzero(np.diff(run)) + 1]
+    lasts = np.r_[firsts[1:] - 1, len(matchedTimes) - 1]
+    return matchedTimes[firsts][run], matchedTimes[lasts][run]
+
+#Returns boolean masks of the echo edges in A and in B.
+#A sensor picking up the other device sees a degraded copy which misses some
+#edges but rarely adds any, so over a run of matched edges the sending channel
+#has extra edges of its own and the echo has fewer.
+def findEchoes(timesA, timesB, offset):
+    shiftedB = timesB + offset
+    matchedA = matchEdges(timesA, shiftedB)
+    matchedB = matchEdges(shiftedB, timesA)
+    extraA = timesA[~matchedA]
+    extraB = shiftedB[~matchedB]
+    echoA = np.zeros(len(timesA), dtype=bool)
+    echoB = np.zeros(len(timesB), dtype=bool)
+    startA, endA = matchedRuns(timesA[matchedA])
+    echoA[matchedA] = countBetween(extraB, startA, endA) > countBetween(extraA, startA, endA)
+    startB, endB = matchedRuns(shiftedB[matchedB])
+    echoB[matchedB] = countBetween(extraA, startB, endB) > countBetween(extraB, startB, endB)
+    return echoA, echoB
+
+def toDurations(times):
+    if len(times) == 0:
+        return []
+    return [int(times[0])] + np.diff(times).tolist()
+
+_cache = {}
+
+#cleaned copies of the A and B channels, cached per record
+def cleanRecord(item):
+    key = (item["id"], len(item["A"]), len(item["B"]), hash(tuple(item["A"])), hash(tuple(item["B"])))
+    if key not in _cache:
+        timesA = edgeTimes(item["A"])
+        timesB = edgeTimes(item["B"])
+        offset = estimateOffset(timesA, timesB)
+        if offset is None:
+            echoA = np.zeros(len(timesA), dtype=bool)
+            echoB = np.zeros(len(timesB), dtype=bool)
+        else:
+            echoA, echoB = findEchoes(timesA, timesB, offset)
+        _cache[key] = {
+            "offset": offset,
+            "A": toDurations(timesA[~echoA]),
+            "B": toDurations(timesB[~echoB]),
+            "echoesA": int(echoA.sum()),
+            "echoesB": int(echoB.sum()),
+        }
+    return _cache[key]
+
+if __name__ == "__main__":
+    with open(sys.argv[1] if len(sys.argv) > 1 else "irdata.json") as f:
+        records = [item for item in json.load(f)["data"] if "B" in item]
+    timeStart = time.monotonic()
+    for item in records:
+        result = cleanRecord(item)
+        print(item["id"], result["offset"], result["echoesA"], result["echoesB"], sep="\t")
+    print("%d records in %.3f s" % (len(records), time.monotonic() - timeStart), file=sys.stderr)
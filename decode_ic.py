@@ -4,6 +4,49 @@ import json, sys
 LONG_GAP = -1
 BYTE_ERROR = -2
 
+#packet status codes for iC_decoder_step2.packets
+STATUS_OK = 0
+STATUS_AUTOFIX = 1
+STATUS_CHKFAIL = 2
+STATUS_ERROR = 3
+STATUS_UNREADABLE = 4
+STATUS_RECOVERED = 5    #by recover.py
+STATUS_NAMES = ["ok", "autofix", "chkfail", "error", "unreadable", "recovered"]
+
+#Timings of the protocols that send bytes as ticks between falling edges, as in
+#the Params class of pycomm/code.py . XrosLink is iC at a quarter of the speed.
+class TickParams:
+    def __init__(self, name, tickLength, tickMargin, longGap):
+        self.name = name
+        self.tickLength = tickLength
+        self.tickMargin = tickMargin
+        self.longGap = longGap
+
+IC_PARAMS = TickParams("ic", 100, 30, 15000)
+XROSLINK_PARAMS = TickParams("xroslink", 400, 100, 15000)
+TICK_PARAMS = {"ic": IC_PARAMS, "ics": IC_PARAMS, "xroslink": XROSLINK_PARAMS}
+
+#Tick period of one trace, for devices whose clocks run a little fast or slow.
+#Only bit intervals of 1 to 3 ticks are used (the interval that ends a byte
+#isn't a whole number of ticks): those within 25% of a whole number of nominal
+#ticks are counted, and the period is the least-squares fit of
+#interval = ticks * period, refined once with the first estimate.
+#Returns the nominal period if there is too little to go on.
+def estimateTick(durations, params=None):
+    import numpy as np
+    if params is None:
+        params = IC_PARAMS
+    intervals = np.asarray(durations[1:], dtype=np.float64)
+    intervals = intervals[intervals < params.longGap]
+    tick = float(params.tickLength)
+    for _ in range(2):
+        ticks = np.round(intervals / tick)
+        usable = (ticks >= 1) & (ticks <= 3) & (np.abs(intervals - ticks * tick) < 0.25 * tick)
+        if usable.sum() < 8:
+            return float(params.tickLength)
+        tick = float((intervals[usable] * ticks[usable]).sum() / (ticks[usable] ** 2).sum())
+    return tick
+
 #calculate the 16 redundancy bits for 16 bits of data
 def redundancyBits(x):
     result = 0x79B4
@@ -33,10 +76,15 @@ def autofix(data, chk):
         mask <<= 1
     return None
 
+#params defaults to iC; tick, if given, replaces params.tickLength for the next
+#decode, with the margin scaled to match
 class iC_decoder:
+    def __init__(self, params=None):
+        self.params = params if params is not None else IC_PARAMS
     def reset(self):
         self.dashes = []
         self.bytes = []
+        self.byteTimes = []
         self.currentByte = 0
         self.pulses = 0
     def addPulse(self):
@@ -53,39 +101,56 @@ class iC_decoder:
             self.addNonPulse()
         self.dashes.append(" ")
         self.bytes.append(self.currentByte)
+        self.byteTimes.append(self.byteStart)
         self.currentByte = 0
         self.pulses = 0
     def abortByte(self):
         self.dashes.append("x ")
         self.bytes.append(BYTE_ERROR)
+        self.byteTimes.append(self.byteStart)
         self.currentByte = 0
         self.pulses = 0
     def longGap(self):
         self.dashes.append("\n")
         self.bytes.append(LONG_GAP)
+        self.byteTimes.append(self.time)
         self.currentByte = 0
         self.pulses = 0
-    def decode(self, durations):
+    def decode(self, durations, tick=None):
         self.reset()
+        tickLength = self.params.tickLength
+        tickMargin = self.params.tickMargin
+        if tick is not None:
+            tickMargin = tickMargin * tick / tickLength
+            tickLength = tick
+        #byteTimes gets the time of the first edge of each byte (for a long gap,
+        #its start), counting from the trigger like the plot
+        self.time = durations[0] if len(durations) > 0 else 0
+        self.byteStart = self.time
         for dur in durations[1:]:
-            ticks = round(dur / 100)
-            dur100 = ticks * 100
-            off100 = abs(dur - dur100)
+            ticks = round(dur / tickLength)
+            durRounded = ticks * tickLength
+            offRounded = abs(dur - durRounded)
             if self.pulses + ticks >= 9:
                 self.endByte()
-            elif off100 > 30:
+            elif offRounded > tickMargin:
                 self.abortByte()
             else:
                 for j in range(ticks - 1):
                     self.addNonPulse()
                 self.addPulse()
-            if dur > 15000:
+            if dur > self.params.longGap:
                 self.longGap()
+            self.time += dur
+            if self.pulses == 0:
+                self.byteStart = self.time
         self.endByte()
     def getDiagram(self):
         return "".join(self.dashes)
     def getBytes(self):
         return self.bytes
+    def getByteTimes(self):
+        return self.byteTimes
     def getHex(self):
         def f(b):
             if b == BYTE_ERROR:
@@ -99,10 +164,15 @@ class iC_decoder:
 class iC_decoder_step2:
     def __init__(self):
         self.startSequence = [0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xFF,0x13,0x70,0x70]
+    #result holds the packets as text; packets holds the same packets as
+    #(start time, data, checksum given, status, bits changed by autofix)
     def reset(self):
         self.result = []
+        self.packets = []
+        self.byteTime = 0
         self.startPacket()
     def startPacket(self):
+        self.packetTime = None
         self.packetCursor = -1
         self.packetBytes = []
         self.packetBytesRaw = []
@@ -112,7 +182,11 @@ class iC_decoder_step2:
             self.result[-1] = self.result[-1] + "?"
         else:
             self.result.append("?")
+            self.addPacket(0, 0, STATUS_UNREADABLE, 0)
         self.startPacket()
+    def addPacket(self, data, chk, status, fixMask):
+        time = self.packetTime if self.packetTime is not None else self.byteTime
+        self.packets.append((time, data, chk, status, fixMask))
     def endPacket(self):
         hexstr = " ".join("%02X" % b for b in self.packetBytesRaw)
         if len(self.packetBytes) == 4 and None not in self.packetBytes:
@@ -120,14 +194,19 @@ class iC_decoder_step2:
             chkGiven = self.packetBytes[3] << 8 | self.packetBytes[2]
             if chkGiven == redundancyBits(data):
                 self.result.append("%04X" % data)
+                self.addPacket(data, chkGiven, STATUS_OK, 0)
             else:
                 dataFixed = autofix(data, chkGiven)
                 if dataFixed is not None:
                     self.result.append("%04X autofix " % dataFixed + hexstr)
+                    #a mask of 0 means the bit was in the checksum
+                    self.addPacket(dataFixed, chkGiven, STATUS_AUTOFIX, data ^ dataFixed)
                 else:
                     self.result.append("chkfail " + hexstr)
+                    self.addPacket(data, chkGiven, STATUS_CHKFAIL, 0)
         else:
             self.result.append("error " + hexstr)
+            self.addPacket(0, 0, STATUS_ERROR, 0)
         self.startPacket()
     def processByte(self, b):
         self.packetCursor += 1
@@ -136,6 +215,8 @@ class iC_decoder_step2:
         elif self.packetCursor == 0 and b in [LONG_GAP, 0xFF]:
             self.packetCursor -= 1
         elif self.packetCursor < 14:
+            if self.packetCursor == 0:
+                self.packetTime = self.byteTime
             if b != self.startSequence[self.packetCursor]:
                 self.abortPacket()
         else:
@@ -156,35 +237,55 @@ class iC_decoder_step2:
                 self.endPacket()
             else:
                 self.packetBytes.append(b)
-    def decode(self, bytes):
+    def decode(self, bytes, times=None):
         self.reset()
-        for b in bytes:
+        for i, b in enumerate(bytes):
+            if times is not None:
+                self.byteTime = times[i]
             self.processByte(b)
     def getHex(self):
         return "\t".join(x for x in self.result)
 
+#One channel's falling-edge intervals through iC_decoder, and for iC through
+#iC_decoder_step2 as well (with the byte times, for the packets' start times).
+#Returns (decoder, decoder2), decoder2 None for protocols without iC packets.
+def decodeChannel(durations, params=None, tick=None):
+    decoder = iC_decoder(params)
+    decoder.decode(durations, tick)
+    if decoder.params is not IC_PARAMS:
+        return decoder, None
+    decoder2 = iC_decoder_step2()
+    decoder2.decode(decoder.getBytes(), decoder.getByteTimes())
+    return decoder, decoder2
+
 def decodeAndPrint(durations, mode, end):
-    decoder.decode(durations)
+    decoder, decoder2 = decodeChannel(durations, tick=estimateTick(durations) if clock else None)
     if mode == "dashes":
         print(decoder.getDiagram(), end=end)
     elif mode == "full":
         print(decoder.getHex(), end=end)
     else:
-        decoder2.decode(decoder.getBytes())
         print(decoder2.getHex(), end=end)
 
 if __name__ == "__main__":
     if len(sys.argv) < 2 or sys.argv[1] not in ["dashes", "full", "checked"]:
-        print("dashes/full/checked?")
+        print("dashes/full/checked? (add \"clean\" to remove A/B crossover, \"clock\" to fit each trace's tick period)")
     else:
-        decoder = iC_decoder()
-        decoder2 = iC_decoder_step2()
+        clean = "clean" in sys.argv[2:]
+        clock = "clock" in sys.argv[2:]
+        if clean:
+            import crossover
         with open("irdata.json") as f:
             for item in json.load(f)["data"]:
                 decodeType = item.get("decode", "")
                 if decodeType == "ic" or decodeType == "ics":
                     print(item["id"], end="\t")
+                    if item.get("hasOnTimes"):
+                        import timeline
+                        item = dict(item, **{c: timeline.recordIntervals(item, c) for c in ["A", "B"] if c in item})
                     if "B" in item:
+                        if clean:
+                            item = crossover.cleanRecord(item)
                         decodeAndPrint(item["A"], sys.argv[1], "\t")
                         print("B:", end="\t")
                         decodeAndPrint(item["B"], sys.argv[1], "\n")
@@ -30,7 +30,7 @@ def decode(pulses):
 if __name__ == "__main__":
     with open("irdata.json") as f:
         for item in json.load(f)["data"]:
-            if item["id"].startswith("mw"):
+            if item.get("decode") == "witches":
                 pulses = item["A"][1:]
                 decoding = decode(pulses)
                 print(" ".join("%02X" % x for x in decoding), end="\t")
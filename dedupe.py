@@ -0,0 +1,155 @@
+import argparse, hashlib, json, sys, time
+import numpy as np
+
+import corpus
+
+#Finding re-captures of the same exchange in the corpus.
+#Each record is reduced to a set of shingles: runs of SHINGLE consecutive
+#durations within a packet (see channelDurations), quantized on a log scale so
+#that capture jitter (e.g. 96 vs 112) mostly lands in the same bucket. MinHash signatures of the
+#shingle sets are split into bands; records sharing any band are candidates,
+#and only candidates are compared, so the work grows with the corpus size
+#rather than with the number of pairs.
+
+STEPS_PER_OCTAVE = 3    #quantization buckets per doubling of a duration
+ON_TIMES_STEPS = 6      #the same for "hasOnTimes" records, whose pulse/gap ratios are finer
+SHINGLE = 12            #intervals per shingle
+NUM_HASHES = 64
+BANDS = 16              #NUM_HASHES/BANDS rows per band
+THRESHOLD = 0.8         #Jaccard similarity for a near duplicate
+PACKET_GAP = 15000
+
+_rng = np.random.default_rng(20240601)
+_MULTIPLIERS = _rng.integers(1, 1 << 63, NUM_HASHES, dtype=np.uint64) | np.uint64(1)
+_ADDENDS = _rng.integers(0, 1 << 63, NUM_HASHES, dtype=np.uint64)
+
+#what a record is compared by: with "hasOnTimes" the on and off durations as
+#they are, since Fusion, Data Link and Tamacon carry their data in the split
+#(summed into falling-edge intervals, different packets can look the same);
+#otherwise the falling-edge intervals, which is all there is
+def channelDurations(item, channel):
+    return item.get(channel, [])
+
+def quantize(durations, steps=STEPS_PER_OCTAVE):
+    return np.round(np.log2(np.maximum(np.asarray(durations, dtype=np.float64), 1)) * steps).astype(np.int64)
+
+#Split at the start gap and at long gaps, leaving out the gaps themselves.
+#Slow protocols (Magical Witches) have every interval over PACKET_GAP, so a gap
+#must also be long compared with the record's typical interval.
+def packets(durations):
+    result = []
+    current = []
+    if len(durations) > 1:
+        gap = max(PACKET_GAP, 4 * np.median(durations[1:]))
+    for i, dur in enumerate(durations):
+        if i == 0 or dur > gap:
+            if len(current) > 0:
+                result.append(current)
+            current = []
+        else:
+            current.append(dur)
+    if len(current) > 0:
+        result.append(current)
+    return result
+
+#64-bit hashes of the record's shingles, tagged with channel so A and B differ
+def shingles(item):
+    hashes = []
+    steps = ON_TIMES_STEPS if item.get("hasOnTimes") else STEPS_PER_OCTAVE
+    for channelNum, channel in enumerate(["A", "B"]):
+        for packet in packets(channelDurations(item, channel)):
+            q = quantize(packet, steps)
+            #short packets become a single shingle
+            width = min(SHINGLE, len(q))
+            h = np.full(len(q) - width + 1, channelNum + 1, dtype=np.uint64)
+            for k in range(width):
+                h = h * np.uint64(1000003) + q[k:len(q) - width + 1 + k].astype(np.uint64)
+            hashes.append(h)
+    if len(hashes) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    return np.unique(np.concatenate(hashes))
+
+def minhash(shingleHashes):
+    if len(shingleHashes) == 0:
+        return np.zeros(NUM_HASHES, dtype=np.uint64)
+    #multiply-add modulo 2**64, one row per hash function
+    with np.errstate(over="ignore"):
+        mixed = shingleHashes[None, :] * _MULTIPLIERS[:, None] + _ADDENDS[:, None]
+    return mixed.min(axis=1)
+
+def jaccard(a, b):
+    if len(a) == 0 and len(b) == 0:
+        return 1.0
+    return len(np.intersect1d(a, b, assume_unique=True)) / len(np.union1d(a, b))
+
+#identical timings, ignoring id, note and labels
+def exactKey(item):
+    channels = [channelDurations(item, channel) for channel in ["A", "B"]]
+    return hashlib.sha1(json.dumps([bool(item.get("hasOnTimes")), channels]).encode()).hexdigest()
+
+#Incremental index: add() each record in turn and get back the id of an earlier
+#record it duplicates (or None), with the kind of duplicate and the similarity.
+#find() and insert() are the two halves, for callers that keep only some records.
+class DuplicateIndex:
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.exact = {}
+        self.buckets = {}
+        self.shingleSets = {}
+    def find(self, item):
+        key = exactKey(item)
+        if key in self.exact:
+            return self.exact[key], "exact", 1.0, None
+        s = shingles(item)
+        signature = minhash(s)
+        bands = [(band, signature[band::BANDS].tobytes()) for band in range(BANDS)]
+        best = (None, None, 0.0)
+        seen = set()
+        for band in bands:
+            for otherId in self.buckets.get(band, []):
+                if otherId not in seen:
+                    seen.add(otherId)
+                    similarity = jaccard(s, self.shingleSets[otherId])
+                    if similarity >= self.threshold and similarity > best[2]:
+                        best = (otherId, "near", similarity)
+        return best + ((key, s, bands),)
+    def insert(self, item, prepared):
+        key, s, bands = prepared
+        self.exact.setdefault(key, item["id"])
+        self.shingleSets[item["id"]] = s
+        for band in bands:
+            self.buckets.setdefault(band, []).append(item["id"])
+    def add(self, item):
+        otherId, kind, similarity, prepared = self.find(item)
+        if prepared is not None and item["id"] not in self.shingleSets:
+            self.insert(item, prepared)
+        return otherId, kind, similarity
+
+#groups of duplicates: list of (first id, [(id, kind, similarity), ...])
+def findDuplicates(records, threshold=THRESHOLD):
+    index = DuplicateIndex(threshold)
+    groupOf = {}
+    groups = {}
+    for item in records:
+        otherId, kind, similarity = index.add(item)
+        if otherId is None:
+            continue
+        root = groupOf.get(otherId, otherId)
+        groupOf[item["id"]] = root
+        groups.setdefault(root, []).append((item["id"], kind, similarity))
+    return list(groups.items())
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Report exact and near-duplicate traces.")
+    argParser.add_argument("--corpus", default=corpus.CORPUS_PATH)
+    argParser.add_argument("--threshold", type=float, default=THRESHOLD, help="Jaccard similarity of shingle sets")
+    args = argParser.parse_args()
+    timeStart = time.monotonic()
+    records = [item for item in corpus.openCorpus(args.corpus).records() if "A" in item]
+    groups = findDuplicates(records, args.threshold)
+    for first, duplicates in groups:
+        print(first)
+        for itemId, kind, similarity in duplicates:
+            print("", itemId, kind, "%.2f" % similarity, sep="\t")
+    count = sum(len(duplicates) for _, duplicates in groups)
+    print("%d records, %d duplicates in %d groups, %.2f s" % (len(records), count, len(groups), time.monotonic() - timeStart), file=sys.stderr)
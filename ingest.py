@@ -0,0 +1,219 @@
+import argparse, asyncio, json, os, re, sys, termios, time, tty
+
+import corpus
+import decode_ic
+import timeline
+
+#Unattended capture: read from one or more capture boards at once and append
+#each record to the corpus as it arrives.
+#twinscope.ino prints JSON records ({"id": "", ... "A": [...]},) and ircomm.ino
+#prints its log as one comma-separated line per exchange, with END markers.
+
+LOG_LINE = re.compile(r"^(?:\d+|END)(?:,(?:\d+|END))*,?$")
+QUEUE_SIZE = 16
+READ_SIZE = 4096
+
+class CaptureParser:
+    def __init__(self):
+        self.buffer = ""
+        self.jsonDecoder = json.JSONDecoder()
+        self.searchFrom = 0
+    #add some text from the device; returns any records completed by it
+    def feed(self, text):
+        self.buffer += text
+        records = []
+        while True:
+            self.buffer = self.buffer.lstrip(" \t\r\n,")
+            if self.buffer.startswith("{"):
+                item = self.parseJson()
+                if item is None:
+                    break
+                if isinstance(item, dict) and "A" in item:
+                    records.append(item)
+            else:
+                newline = self.buffer.find("\n")
+                if newline == -1:
+                    break
+                line = self.buffer[:newline].strip()
+                self.buffer = self.buffer[newline+1:]
+                item = self.parseLog(line)
+                if item is not None:
+                    records.append(item)
+        return records
+    def parseJson(self):
+        #only try again once another closing brace has arrived
+        close = self.buffer.find("}", self.searchFrom)
+        if close == -1:
+            self.searchFrom = len(self.buffer)
+            return None
+        try:
+            item, end = self.jsonDecoder.raw_decode(self.buffer)
+        except json.JSONDecodeError:
+            if "\n{" in self.buffer[1:close]:
+                #garbled record followed by a new one: drop up to the new one
+                self.buffer = self.buffer[self.buffer.index("\n{", 1) + 1:]
+            else:
+                self.searchFrom = close + 1
+            return None
+        self.buffer = self.buffer[end:]
+        self.searchFrom = 0
+        return item
+    def parseLog(self, line):
+        if not LOG_LINE.match(line):
+            return None
+        durations = [int(x) for x in line.rstrip(",").split(",") if x != "END"]
+        if len(durations) == 0:
+            return None
+        return {"id": "", "note": "", "hasOnTimes": True, "A": durations}
+
+#each trace's own tick period is used, so a device with a fast or slow clock
+#still decodes without a recapture
+def decodeRecord(item):
+    if item.get("decode", "") not in decode_ic.TICK_PARAMS:
+        return ""
+    params = decode_ic.TICK_PARAMS[item["decode"]]
+    results = []
+    for channel in ["A", "B"]:
+        if channel in item:
+            durations = timeline.recordIntervals(item, channel)
+            decoder, decoder2 = decode_ic.decodeChannel(durations, params, decode_ic.estimateTick(durations, params))
+            results.append(channel + ":\t" + (decoder2 or decoder).getHex())
+    return "\t".join(results)
+
+#durations that aren't whole numbers would break every reader of the corpus
+def isValidRecord(item):
+    return all(isinstance(item[channel], list) and all(type(d) is int and d >= 0 for d in item[channel])
+        for channel in ["A", "B"] if channel in item)
+
+def openDevice(path, baud):
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    if os.isatty(fd):
+        tty.setraw(fd, termios.TCSANOW)
+        speed = getattr(termios, "B%d" % baud)
+        attributes = termios.tcgetattr(fd)
+        attributes[4] = attributes[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    return os.fdopen(fd, "rb", buffering=0)
+
+#Read one device until it closes. The queue is bounded, so if the writer falls
+#behind we stop reading and the data waits in the StreamReader and the tty buffer.
+async def readDevice(path, baud, queue):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1 << 16)
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), openDevice(path, baud))
+    parser = CaptureParser()
+    try:
+        while True:
+            try:
+                data = await reader.read(READ_SIZE)
+            except OSError:
+                #pty closed on the other side, or board unplugged
+                break
+            if not data:
+                break
+            for item in parser.feed(data.decode("ascii", errors="replace")):
+                await queue.put((path, item))
+    finally:
+        transport.close()
+
+#corpusPath None means decode and report only; onRecord(item, decoded) is
+#called for each record once it has been stored.
+#With collapseDuplicates, a record that duplicates one already in the corpus
+#(see dedupe.py) is reported but not stored.
+class Ingester:
+    def __init__(self, corpusPath, idPrefix, output=sys.stdout, onRecord=None, collapseDuplicates=False):
+        self.corpusPath = corpusPath
+        self.corpus = corpus.openCorpus(corpusPath) if corpusPath is not None else None
+        self.idPrefix = idPrefix
+        self.output = output
+        self.onRecord = onRecord
+        self.count = 0
+        self.duplicates = None
+        if collapseDuplicates:
+            import dedupe
+            self.duplicates = dedupe.DuplicateIndex()
+            if self.corpus is not None:
+                for item in self.corpus.records():
+                    if "A" in item:
+                        self.duplicates.add(item)
+    def label(self, path, item):
+        self.count += 1
+        if item.get("id", "") == "":
+            item["id"] = "%s-%s-%d" % (self.idPrefix, time.strftime("%Y%m%d-%H%M%S"), self.count)
+        if item.get("note", "") == "":
+            item["note"] = "captured from " + path
+        return item
+    #the record's edge timeline goes into the cache now, so it isn't converted again
+    def store(self, item):
+        before = timeline.corpusVersion(self.corpusPath)
+        self.corpus.appendRecords([item])
+        timeline.extend(self.corpusPath, [item], before)
+    #one bad record is reported and skipped; the writer keeps going for the rest
+    async def write(self, queue):
+        while True:
+            path, item = await queue.get()
+            try:
+                await self.writeRecord(path, item)
+            except Exception as e:
+                print("%s: record %r not stored: %s" % (path, item.get("id", ""), e), file=sys.stderr, flush=True)
+            finally:
+                queue.task_done()
+    async def writeRecord(self, path, item):
+        loop = asyncio.get_running_loop()
+        if not isValidRecord(item):
+            raise ValueError("durations must be lists of non-negative integers")
+        item = self.label(path, item)
+        #decoding and file writes happen off the event loop so reading continues
+        try:
+            decoded = await loop.run_in_executor(None, decodeRecord, item)
+        except Exception as e:
+            #still worth keeping the trace
+            decoded = "(not decoded: %s)" % e
+        duplicateOf = None
+        if self.duplicates is not None:
+            duplicateOf, kind, similarity, prepared = self.duplicates.find(item)
+            if duplicateOf is None:
+                self.duplicates.insert(item, prepared)
+        if self.corpus is not None and duplicateOf is None:
+            await loop.run_in_executor(None, self.store, item)
+        if duplicateOf is not None:
+            decoded = "%s\t(%s duplicate of %s, not stored)" % (decoded, kind, duplicateOf)
+        print(item["id"], len(item["A"]), decoded, sep="\t", file=self.output, flush=True)
+        if self.onRecord is not None:
+            self.onRecord(item, decoded)
+    async def run(self, devices, baud):
+        queue = asyncio.Queue(QUEUE_SIZE)
+        writer = asyncio.create_task(self.write(queue))
+        readers = asyncio.gather(*(readDevice(path, baud, queue) for path in devices))
+        try:
+            await whileRunning(readers, writer)
+            await whileRunning(queue.join(), writer)
+        finally:
+            readers.cancel()
+            writer.cancel()
+
+#Wait for awaitable, but stop if task ends first (with its exception), instead of
+#waiting for ever on a queue nobody empties.
+async def whileRunning(awaitable, task):
+    future = asyncio.ensure_future(awaitable)
+    await asyncio.wait([future, task], return_when=asyncio.FIRST_COMPLETED)
+    if not future.done():
+        future.cancel()
+        task.result()
+        raise RuntimeError("writer stopped")
+    return future.result()
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Append captures from serial devices to the corpus.")
+    argParser.add_argument("devices", nargs="+")
+    argParser.add_argument("--corpus", default=corpus.CORPUS_PATH, help="irdata.json or a segment store directory")
+    argParser.add_argument("--baud", type=int, default=9600)
+    argParser.add_argument("--prefix", default="capture", help="id prefix for records without an id")
+    argParser.add_argument("--collapse-duplicates", action="store_true",
+        help="don't store records that duplicate one already in the corpus")
+    args = argParser.parse_args()
+    try:
+        asyncio.run(Ingester(args.corpus, args.prefix, collapseDuplicates=args.collapse_duplicates).run(args.devices, args.baud))
+    except KeyboardInterrupt:
+        pass
@@ -2,6 +2,7 @@
 
 const uint16_t WAIT = 0xFFFF;
 const uint16_t END = 0xFFFE;
+const uint16_t CALL = 0xFFFD;
 
 class SequenceHandler {
 public:
@@ -10,9 +11,10 @@ public:
     uint16_t replyDelay;
     void list(Stream& output);
     int8_t load(uint8_t id);
-    uint16_t get(uint16_t i);
+    uint16_t next();
 private:
     uint16_t * durationsPGM;
+    uint16_t * returnPGM;
 };
 
 extern SequenceHandler sequenceHandler;
@@ -27,8 +27,11 @@ void setup() {
 uint16_t packDur(uint32_t dur) {
     if (dur < 0x8000) {
         return dur;
-    } else if (dur < 0x100000) {
+    } else if (dur < 0xFFFA0) {
         return 0x8000 | (dur >> 5);
+    } else if (dur < 0x100000) {
+        //the values above are CALL, END and WAIT
+        return CALL - 1;
     } else {
         return END;
     }
@@ -61,13 +64,13 @@ void delaySincePrev(uint32_t dur) {
     }
 }
 
-void outputPulse(uint16_t t) {
+void outputPulse(uint32_t t) {
     digitalWrite(pinIrLed, HIGH);
     delaySincePrev(t);
     digitalWrite(pinIrLed, LOW);
 }
 
-void outputModulated(uint16_t t) {
+void outputModulated(uint32_t t) {
     uint16_t pulses;
     if (t > 1500) {
         pulses = (t / 64) * 39 / 16;
@@ -139,7 +142,6 @@ int8_t receivePacket(bool first) {
 }
 
 void execute() {
-    uint16_t cursor = 0;
     uint16_t item;
     bool wasOn = false;
     logSize = 0;
@@ -150,7 +152,7 @@ void execute() {
     }
     delaySincePrev(0);
     while (true) {
-        item = sequenceHandler.get(cursor);
+        item = sequenceHandler.next();
         if (item == END) {
             return;
         }
@@ -165,17 +167,16 @@ void execute() {
             delaySincePrev(0);
         } else {
             if (wasOn) {
-                delaySincePrev(item);
+                delaySincePrev(unpackDur(item));
                 wasOn = false;
             } else if (sequenceHandler.isModulated) {
-                outputModulated(item);
+                outputModulated(unpackDur(item));
                 wasOn = true;
             } else {
-                outputPulse(item);
+                outputPulse(unpackDur(item));
                 wasOn = true;
             }
         }
-        cursor ++;
     }
 }
 
@@ -1,4 +1,8 @@
 
+const PACKET_GAP = 15000;
+const PULSE = 1;   //width of pulses whose off edge wasn't captured
+const LIVE_RETRIES = 5;
+
 function LineMaker(height, yStep) {
     let values = [];
     let markers = [];
@@ -6,12 +10,11 @@ function LineMaker(height, yStep) {
     let y = 0;
     let rows = 0;
 
-    function add(durations, name, label, decode) {
-        let x = 0;
+    function add(timeline, name, label, decode) {
+        let times = timeline.times;
+        let levels = timeline.levels;
         let prevXtoOn = -2000;
-        let isOn = false;
-        values.push({name: name, x: -100, y: y});
-        for (let i = 0; i <= durations.length; i ++) {
+        function point(x, isOn) {
             if (isOn) {
                 values.push({name: name, x: x, y: y + height});
             } else {
@@ -23,10 +26,18 @@ function LineMaker(height, yStep) {
                     prevXtoOn = x;
                 }
             }
-            if (i < durations.length) {
-                x += durations[i];
+        }
+        values.push({name: name, x: -100, y: y});
+        point(0, false);
+        for (let i = 0; i < times.length; i ++) {
+            point(times[i], levels[i] == 1);
+            //an on edge with no off edge after it (only falling edges were captured)
+            let last = i == times.length - 1;
+            let offNext = last ? i > 0 && levels[i-1] == 0 : levels[i+1] == 0;
+            if (levels[i] == 1 && !offNext) {
+                let gap = last ? 2 * PULSE : times[i+1] - times[i];
+                point(times[i] + Math.min(PULSE, gap / 2), false);
             }
-            isOn = !isOn;
         }
         if (label != null) {
             labels.push({y: y, label: label});
@@ -65,41 +76,52 @@ function LineMaker(height, yStep) {
     };
 }
 
-function selectPacket(durations, packetNum) {
-    if (packetNum == 0) {
-        return durations;
-    }
-    let result = [];
-    let packetCursor = 0;
+//Edge times from the trigger and the level after each edge (1 for on), with
+//the index of each packet's first edge, as timeline.py makes them; for when
+//irtimeline.json isn't served, done once per record as it is loaded.
+//Records without "hasOnTimes" only have on (falling) edges.
+function edgeTimeline(durations, hasOnTimes) {
+    let times = [];
+    let levels = [];
+    let packets = [];
+    let t = 0;
     for (let i = 0; i < durations.length; i ++) {
-        let dur = durations[i];
-        if (i == 0 || dur > 15000) {
-            dur = 0;
-            packetCursor ++;
+        t += durations[i];
+        if (i == 0 || durations[i] > PACKET_GAP) {
+            packets.push(i);
         }
-        if (packetCursor == packetNum) {
-            result.push(dur);
+        times.push(t);
+        levels.push(hasOnTimes && i % 2 == 1 ? 0 : 1);
+    }
+    return {times: times, levels: levels, packets: packets};
+}
+
+function recordTimeline(record) {
+    let timeline = {};
+    for (let channel of ["A", "B"]) {
+        if (record[channel]) {
+            timeline[channel] = edgeTimeline(record[channel], record.hasOnTimes);
         }
     }
-    return result;
+    return timeline;
 }
 
-function insertOnTimes(durations, pulse) {
-    if (durations.length == 0) {
-        return [];
+//edges of packet packetNum (from 1; 0 for all), timed from its first edge
+function selectPacket(timeline, packetNum) {
+    packetNum = Number(packetNum);
+    if (packetNum == 0) {
+        return timeline;
     }
-    let result = [durations[0]];
-    for (let i = 1; i < durations.length; i ++) {
-        if (durations[i] > pulse) {
-            result.push(pulse);
-            result.push(durations[i] - pulse);
-        } else {
-            result.push(pulse/10);
-            result.push(pulse/10);
-        }
+    if (packetNum > timeline.packets.length) {
+        return {times: [], levels: []};
     }
-    result.push(pulse);
-    return result;
+    let start = timeline.packets[packetNum - 1];
+    let end = packetNum < timeline.packets.length ? timeline.packets[packetNum] : timeline.times.length;
+    let startTime = timeline.times[start];
+    return {
+        times: timeline.times.slice(start, end).map(function(t) { return t - startTime; }),
+        levels: timeline.levels.slice(start, end)
+    };
 }
 
 function readConfigFromDocument() {
@@ -172,28 +194,20 @@ function plot(records) {
         if (config.label === "wasHitA" && records[id].wasHitA) {
             label = id + " " + records[id].wasHitA;
         }
-        let dursA = records[id].A;
-        let dursB = records[id].B;
-        if (!dursB) {
-            dursB = [];
-        }
-        dursA = selectPacket(dursA, config.packet);
-        dursB = selectPacket(dursB, config.packet);
-        if (!records[id].hasOnTimes) {
-            dursA = insertOnTimes(dursA, 1);
-            dursB = insertOnTimes(dursB, 1);
-        }
+        let empty = {times: [], levels: [], packets: []};
+        let edgesA = selectPacket(records[id].timeline.A || empty, config.packet);
+        let edgesB = selectPacket(records[id].timeline.B || empty, config.packet);
         if (config.channel === "A") {
-            LM.add(dursA, id + " (A)", label, decode);
+            LM.add(edgesA, id + " (A)", label, decode);
         } else if (config.channel === "B") {
-            LM.add(dursB, id + " (B)", label, decode);
+            LM.add(edgesB, id + " (B)", label, decode);
         } else if (config.channel === "below") {
-            LM.add(dursA, id + " (A)", label + " (A)", decode);
-            LM.add(dursB, id + " (B)", label + " (B)", decode);
+            LM.add(edgesA, id + " (A)", label + " (A)", decode);
+            LM.add(edgesB, id + " (B)", label + " (B)", decode);
         } else {
             //overlap
-            LM.add(dursA, id + " (A)", null, decode);
-            LM.add(dursB, id + " (B)", label, decode);
+            LM.add(edgesA, id + " (A)", null, decode);
+            LM.add(edgesB, id + " (B)", label, decode);
         }
     }
     
@@ -268,35 +282,95 @@ function plot(records) {
     vegaEmbed('#vis', vlSpec);
 }
 
+function addRecordRow(records, record, selectPosition) {
+    let id = record.id;
+    let tableRow = $("<tr>");
+    if (id in records) {
+        //can't use it twice
+        tableRow.append(($("<td>")).append("x"));
+    } else {
+        //OK
+        records[id] = record;
+        let weightBox = $('<input type="number" name="weight" class="weight" min="0" value="0">');
+        weightBox.prop("id", id);
+        tableRow.append(($("<td>")).append(weightBox));
+        if (selectPosition > 0) {
+            weightBox.val(selectPosition);
+        }
+    }
+    tableRow.append(($("<td>")).text(id));
+    tableRow.append(($("<td>")).text(record.shotSizeA));
+    tableRow.append(($("<td>")).text(record.wasHitA));
+    tableRow.append(($("<td>")).text(record.note));
+    $("#records").find("tbody").append(tableRow);
+    return tableRow;
+}
+
+//retries with growing delays, and gives up after LIVE_RETRIES failures in a row
+//(e.g. when the page is served by something other than liveplot.py)
+function connectLive(records, failures) {
+    failures = failures || 0;
+    //only liveplot.py serves /live
+    let socket = new WebSocket("ws://" + location.host + "/live");
+    let opened = false;
+    socket.onopen = function() {
+        opened = true;
+        if ($("#decodedHeader").length == 0) {
+            $("#records").find("thead tr").append('<th id="decodedHeader">Decoded<br>(live captures)</th>');
+        }
+    };
+    socket.onmessage = function(event) {
+        let message = JSON.parse(event.data);
+        let selection = readConfigFromDocument().selection;
+        let position = 1;
+        if (selection.length > 0) {
+            position = Number(selection[selection.length - 1].weight) + 1;
+        }
+        message.record.timeline = message.timeline || recordTimeline(message.record);
+        let tableRow = addRecordRow(records, message.record, position);
+        if (message.decoded) {
+            tableRow.append(($("<td>")).text(message.decoded));
+        }
+        plot(records);
+    };
+    socket.onclose = function() {
+        failures = opened ? 0 : failures + 1;
+        if (failures < LIVE_RETRIES) {
+            setTimeout(function() { connectLive(records, failures); }, 2000 * Math.pow(2, failures));
+        }
+    };
+}
+
 $(document).ready(function() {
     let records = {}
     $.getJSON("irdata.json", function(data) {
-        let recordsTbody = $("#records").find("tbody");
-        for (let i = 0; i < data.data.length; i ++) {
-            let record = data.data[i];
-            let id = record.id;
-            let tableRow = $("<tr>");
-            if (id in records) {
-                //can't use it twice
-                tableRow.append(($("<td>")).append("x"));
-            } else {
-                //OK
-                records[id] = record;
-                let weightBox = $('<input type="number" name="weight" class="weight" min="0" value="0">');
-                weightBox.prop("id", id);
-                tableRow.append(($("<td>")).append(weightBox));
-                //select something initially
-                if (i < 2) {
-                    weightBox.val(i + 1);
+        //liveplot.py serves the timelines from the cache next to the corpus
+        $.getJSON("irtimeline.json", function(timelines) {
+            let byId = {};
+            for (let i = 0; i < timelines.data.length; i ++) {
+                if (!(timelines.data[i].id in byId)) {
+                    byId[timelines.data[i].id] = timelines.data[i];
                 }
             }
-            tableRow.append(($("<td>")).text(id));
-            tableRow.append(($("<td>")).text(record.shotSizeA));
-            tableRow.append(($("<td>")).text(record.wasHitA));
-            tableRow.append(($("<td>")).text(record.note));
-            recordsTbody.append(tableRow);
-        }
-        plot(records);
+            for (let i = 0; i < data.data.length; i ++) {
+                let timeline = byId[data.data[i].id];
+                if (timeline) {
+                    data.data[i].timeline = timeline;
+                }
+            }
+        }).always(function() {
+            for (let i = 0; i < data.data.length; i ++) {
+                if (!data.data[i].timeline) {
+                    data.data[i].timeline = recordTimeline(data.data[i]);
+                }
+                //select something initially
+                addRecordRow(records, data.data[i], i < 2 ? i + 1 : 0);
+            }
+            plot(records);
+            if (location.hostname === "localhost" || location.hostname === "127.0.0.1") {
+                connectLive(records);
+            }
+        });
     });
     $("#buttonPlot").click(function() {
         plot(records);
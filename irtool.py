@@ -0,0 +1,238 @@
+import argparse, json
+
+#One command line for the corpus tools:
+#  irtool.py decode ic [dashes|full|checked] [--clean] [--clock] [--recover] [--table OUT.npz]
+#  irtool.py decode xroslink [dashes|full] [--clock]
+#  irtool.py decode witches
+#  irtool.py decode auto [--clock]
+#  irtool.py classify
+#  irtool.py lengths / stats / export OUT
+#  irtool.py watch [--clean] [--clock]
+#each taking --corpus (repeatable; irdata.json or a segment store) and the
+#record filters --id, --decode and --note.
+#lengths and stats only need each record's metadata, which is cached next to
+#the corpus and rebuilt when the corpus changes, so they don't parse the traces;
+#the decoders take the traces from the edge timeline cache (timeline.py).
+#Modules for the other commands are imported when they run.
+
+CORPUS_PATH = "irdata.json"
+METADATA_FIELDS = ["id", "note", "decode", "shotSizeA", "wasHitA", "hasOnTimes"]
+METADATA_VERSION = 1
+
+def metadata(item):
+    result = {key: item[key] for key in METADATA_FIELDS if key in item}
+    result["lengthA"] = len(item.get("A", []))
+    if "B" in item:
+        result["lengthB"] = len(item["B"])
+    return result
+
+def loadMetadata(path):
+    import corpus
+    cachePath = corpus.sidecarPath(path, "metadata")
+    version = corpus.corpusVersion(path, METADATA_VERSION)
+    try:
+        with open(cachePath) as f:
+            cache = json.load(f)
+        if cache["version"] == version:
+            return cache["records"]
+    except (OSError, ValueError, KeyError):
+        pass
+    records = [metadata(item) for item in corpus.openCorpus(path).records()]
+    corpus.writeCache(cachePath, json.dumps({"version": version, "records": records}, separators=(",", ":")))
+    return records
+
+def selected(item, args):
+    if args.id is not None:
+        import fnmatch
+        if not fnmatch.fnmatchcase(item["id"], args.id):
+            return False
+    if args.decode is not None and item.get("decode", "") != args.decode:
+        return False
+    if args.note is not None and args.note.lower() not in item.get("note", "").lower():
+        return False
+    return True
+
+def selectedMetadata(args):
+    for path in args.corpus:
+        for item in loadMetadata(path):
+            if selected(item, args):
+                yield item
+
+def selectedRecords(args):
+    import corpus
+    for path in args.corpus:
+        for item in corpus.openCorpus(path).records():
+            if selected(item, args):
+                yield item
+
+#Selected records' metadata with each channel's (times, levels) from the edge
+#timeline cache (see timeline.py), for the decoders: when both caches are up to
+#date the traces aren't parsed at all.
+def selectedTimelines(args):
+    import timeline
+    for path in args.corpus:
+        records = loadMetadata(path)
+        timelines = timeline.load(path)
+        if timelines.ids.tolist() != [item["id"] for item in records]:
+            #the corpus changed between building the two; convert this version again
+            import corpus
+            items = list(corpus.openCorpus(path).records())
+            records = [metadata(item) for item in items]
+            timelines = timeline.Timelines.fromRecords(items)
+        for record, item in enumerate(records):
+            if selected(item, args):
+                yield item, {channel: timelines.channel(record, channel) for channel in timeline.CHANNELS if timelines.has(record, channel)}
+
+def commandLengths(args):
+    for item in selectedMetadata(args):
+        print(item["id"], "\t", item["lengthA"], "\t", item.get("lengthB", 0))
+
+def commandStats(args):
+    records = list(selectedMetadata(args))
+    counts = {}
+    for item in records:
+        decodeType = item.get("decode", "(none)")
+        counts[decodeType] = counts.get(decodeType, 0) + 1
+    ids = [item["id"] for item in records]
+    print("records", len(records), sep="\t")
+    print("two channels", sum(1 for item in records if "lengthB" in item), sep="\t")
+    print("intervals", sum(item["lengthA"] + item.get("lengthB", 0) for item in records), sep="\t")
+    print("duplicate ids", len(ids) - len(set(ids)), sep="\t")
+    for decodeType, count in sorted(counts.items()):
+        print("decode " + decodeType, count, sep="\t")
+
+#family from the decode field (e.g. "junk" stays junk), or guessed from the
+#durations if there isn't one; the confidence is None when not guessed
+def recordFamily(item):
+    if "decode" in item:
+        return item["decode"], None
+    import protocols
+    family, confidence, _ = protocols.classify(item)
+    return family, confidence
+
+def commandClassify(args):
+    import protocols
+    for item in selectedRecords(args):
+        if "A" in item:
+            family, confidence, _ = protocols.classify(item)
+            print(item["id"], family, "%.2f" % confidence, item.get("decode", ""), sep="\t")
+
+#every record in one pass, each with the decoder for its family
+def commandDecodeAuto(args):
+    import decode_ic, decode_witches, timeline
+    for item, edges in selectedTimelines(args):
+        if "A" not in edges:
+            continue
+        if "decode" not in item or item["decode"] == "witches":
+            #classify and decode_witches take the durations as stored
+            item = dict(item, **{channel: timeline.durations(times) for channel, (times, _) in edges.items()})
+        family, confidence = recordFamily(item)
+        guess = "" if confidence is None else " %.2f" % confidence
+        results = []
+        if family in decode_ic.TICK_PARAMS:
+            params = decode_ic.TICK_PARAMS[family]
+            for channel in ["A", "B"]:
+                if channel in edges:
+                    durations = timeline.intervals(*edges[channel])
+                    tick = decode_ic.estimateTick(durations, params) if args.clock else None
+                    decoder, decoder2 = decode_ic.decodeChannel(durations, params, tick)
+                    results.append(channel + ":\t" + (decoder2 or decoder).getHex())
+        elif family == "witches":
+            results.append("A:\t" + " ".join("%02X" % x for x in decode_witches.decode(item["A"][1:])))
+        print(item["id"], family + guess, *results, sep="\t")
+
+def commandDecode(args):
+    if args.protocol == "auto":
+        commandDecodeAuto(args)
+        return
+    if args.protocol == "witches":
+        import decode_witches
+        for item in selectedRecords(args):
+            if item.get("decode") == "witches":
+                decoding = decode_witches.decode(item["A"][1:])
+                print(" ".join("%02X" % x for x in decoding), item["id"], sep="\t")
+        return
+    import decode_ic, timeline
+    if args.clean:
+        import crossover
+    params = decode_ic.TICK_PARAMS[args.protocol]
+    decodeTypes = [t for t, p in decode_ic.TICK_PARAMS.items() if p is params]
+    builder = None
+    if args.table is not None and params is decode_ic.IC_PARAMS:
+        import packettable
+        builder = packettable.PacketTableBuilder()
+    recovering = args.recover and args.mode == "checked" and params is decode_ic.IC_PARAMS
+    if recovering:
+        import recover
+    def decodeChannel(durations, record, channelNum):
+        tick = decode_ic.estimateTick(durations, params) if args.clock else None
+        if recovering:
+            decoded, _ = recover.decodeWithRecovery(durations, tick)
+            if builder is not None:
+                builder.addChannel(record, channelNum, decoded)
+            return decoded.getHex()
+        decoder, decoder2 = decode_ic.decodeChannel(durations, params, tick)
+        if builder is not None:
+            builder.addChannel(record, channelNum, decoder2)
+        if args.mode == "dashes":
+            return decoder.getDiagram()
+        #the checked packet framing is iC's
+        if args.mode != "checked" or decoder2 is None:
+            return decoder.getHex()
+        return decoder2.getHex()
+    for item, edges in selectedTimelines(args):
+        if item.get("decode", "") not in decodeTypes:
+            continue
+        item = dict(item, **{channel: timeline.intervals(times, levels) for channel, (times, levels) in edges.items()})
+        record = builder.addRecord(item) if builder is not None else None
+        if "B" in item:
+            channels = crossover.cleanRecord(item) if args.clean else item
+            print(item["id"], decodeChannel(channels["A"], record, 0), "B:", decodeChannel(channels["B"], record, 1), sep="\t")
+        else:
+            print(item["id"], decodeChannel(item["A"], record, 0), sep="\t")
+    if builder is not None:
+        builder.table().save(args.table)
+
+def commandExport(args):
+    import corpus
+    corpus.writeAtomic(args.output, corpus.formatFile(list(selectedRecords(args))))
+
+def commandWatch(args):
+    import watch
+    watch.Watcher(args.corpus, args.clean, lambda item: selected(item, args), args.clock).run(args.interval)
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Tools for the IR capture corpus.")
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument("--corpus", action="append", help="irdata.json (default) or a segment store; may be repeated")
+    filters.add_argument("--id", help="only ids matching this pattern, e.g. 'wha-*'")
+    filters.add_argument("--decode", help="only records with this decode field, e.g. ic")
+    filters.add_argument("--note", help="only records whose note contains this")
+    commands = argParser.add_subparsers(dest="command", required=True)
+    decodeParser = commands.add_parser("decode", parents=[filters], help="decode records")
+    decodeParser.add_argument("protocol", choices=["ic", "xroslink", "witches", "auto"],
+        help="auto: each record by its decode field, or by protocols.py if it has none")
+    decodeParser.add_argument("mode", nargs="?", choices=["dashes", "full", "checked"], default="checked", help="for ic")
+    decodeParser.add_argument("--clean", action="store_true", help="remove A/B crossover first (ic)")
+    decodeParser.add_argument("--clock", action="store_true", help="fit each trace's tick period first (ic, xroslink)")
+    decodeParser.add_argument("--recover", action="store_true", help="repair the trace of packets that fail (ic checked; see recover.py)")
+    decodeParser.add_argument("--table", metavar="OUT.npz", help="also write the packets as columns (ic; see packettable.py)")
+    decodeParser.set_defaults(run=commandDecode)
+    commands.add_parser("classify", parents=[filters], help="guess each record's protocol").set_defaults(run=commandClassify)
+    commands.add_parser("lengths", parents=[filters], help="number of intervals per channel").set_defaults(run=commandLengths)
+    commands.add_parser("stats", parents=[filters], help="summary of the corpus").set_defaults(run=commandStats)
+    exportParser = commands.add_parser("export", parents=[filters], help="write the selected records to a file")
+    exportParser.add_argument("output")
+    exportParser.set_defaults(run=commandExport)
+    watchParser = commands.add_parser("watch", parents=[filters], help="print changes to the decodings as the corpus is edited")
+    watchParser.add_argument("--clean", action="store_true", help="remove A/B crossover first (ic)")
+    watchParser.add_argument("--clock", action="store_true", help="fit each trace's tick period first (ic, xroslink)")
+    watchParser.add_argument("--interval", type=float, default=0.5, help="seconds between checks")
+    watchParser.set_defaults(run=commandWatch)
+    args = argParser.parse_args()
+    if args.corpus is None:
+        args.corpus = [CORPUS_PATH]
+    try:
+        args.run(args)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
@@ -0,0 +1,185 @@
+import argparse, asyncio, base64, hashlib, json, os, struct, sys
+
+import corpus
+import ingest
+import timeline
+
+#Local server for index.html during capture sessions. Serves the page and the
+#corpus as usual, and pushes each newly ingested record and its decoding to the
+#page over a WebSocket at /live, so it is added to the table and plotted without
+#a reload. Open http://localhost:8000/ while it runs.
+#The page gets the records' edge timelines (timeline.py) from /irtimeline.json
+#and with each new record, so it doesn't convert the traces itself.
+
+STATIC_FILES = {
+    "/": ("index.html", "text/html"),
+    "/index.html": ("index.html", "text/html"),
+    "/irplot.js": ("irplot.js", "text/javascript"),
+}
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B30"
+MAX_PENDING = 1 << 20   #bytes waiting to go to one page before it is dropped
+SEND_TIMEOUT = 10       #seconds for a page to take a record
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def websocketFrame(text):
+    payload = text.encode()
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, len(payload))
+    elif len(payload) < 0x10000:
+        header = struct.pack("!BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, len(payload))
+    return header + payload
+
+class LivePlotServer:
+    def __init__(self, corpusPath):
+        self.corpusPath = corpusPath
+        self.clients = set()
+        self.sending = set()
+    #a page that stops reading (e.g. a stalled tab) is dropped rather than
+    #letting its frames pile up for the rest of the session
+    def publish(self, item, decoded):
+        edges = timeline.Timelines.fromRecords([item]).jsonRecord(0)
+        frame = websocketFrame(json.dumps({"record": item, "decoded": decoded, "timeline": edges}))
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > MAX_PENDING:
+                self.drop(writer)
+                continue
+            writer.write(frame)
+            task = asyncio.ensure_future(self.drain(writer))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+    async def drain(self, writer):
+        try:
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            self.drop(writer)
+    def drop(self, writer):
+        self.clients.discard(writer)
+        writer.close()
+    async def handle(self, reader, writer):
+        try:
+            requestLine = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if line == "":
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(requestLine) < 2 or requestLine[0] != "GET":
+                await self.respond(writer, "405 Method Not Allowed", "text/plain", b"GET only\n")
+                return
+            path = requestLine[1].split("?")[0]
+            if path == "/live" and headers.get("upgrade", "").lower() == "websocket":
+                await self.serveWebsocket(reader, writer, headers)
+            elif path == "/irdata.json":
+                loop = asyncio.get_running_loop()
+                body = await loop.run_in_executor(None, self.corpusText)
+                await self.respond(writer, "200 OK", "application/json", body)
+            elif path == "/irtimeline.json":
+                loop = asyncio.get_running_loop()
+                body = await loop.run_in_executor(None, self.timelineText)
+                await self.respond(writer, "200 OK", "application/json", body)
+            elif path in STATIC_FILES:
+                fileName, contentType = STATIC_FILES[path]
+                with open(os.path.join(HERE, fileName), "rb") as f:
+                    body = f.read()
+                await self.respond(writer, "200 OK", contentType, body)
+            else:
+                await self.respond(writer, "404 Not Found", "text/plain", b"not found\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    def corpusText(self):
+        source = corpus.openCorpus(self.corpusPath)
+        if not isinstance(source, corpus.JsonFile):
+            #a segment store or a packed .npz
+            return corpus.formatFile(list(source.records())).encode()
+        with open(self.corpusPath, "rb") as f:
+            return f.read()
+    #from the cache, which the ingester extends as records arrive
+    def timelineText(self):
+        return timeline.load(self.corpusPath).jsonText().encode()
+    async def respond(self, writer, status, contentType, body):
+        writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+            "Cache-Control: no-cache\r\nConnection: close\r\n\r\n" % (status, contentType, len(body))).encode())
+        writer.write(body)
+        await writer.drain()
+    async def serveWebsocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+            "Connection: Upgrade\r\nSec-WebSocket-Accept: %s\r\n\r\n" % accept).encode())
+        await writer.drain()
+        self.clients.add(writer)
+        try:
+            #nothing is expected from the page; just wait for a close frame or EOF
+            while True:
+                header = await reader.readexactly(2)
+                opcode = header[0] & 0x0F
+                length = header[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", await reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", await reader.readexactly(8))[0]
+                if header[1] & 0x80:
+                    length += 4
+                await reader.readexactly(length)
+                if opcode == 0x8:
+                    break
+        finally:
+            self.clients.discard(writer)
+
+#Stand-in for a capture board: a pty that prints records the way twinscope.ino
+#does, one every "interval" seconds. Returns the device path to read from.
+def simulateBoard(records, interval):
+    master, slave = os.openpty()
+    path = os.ttyname(slave)
+    async def play():
+        loop = asyncio.get_running_loop()
+        for item in records:
+            await asyncio.sleep(interval)
+            item = dict(item, id="sim-" + item["id"])
+            text = corpus.formatRecord(item) + ",\n\n"
+            await loop.run_in_executor(None, os.write, master, text.encode())
+    return path, play
+
+async def main(args):
+    corpusPath = args.corpus
+    if corpusPath is None:
+        corpusPath = corpus.CORPUS_PATH
+    server = LivePlotServer(corpusPath)
+    #simulated records are not saved unless a corpus is given explicitly
+    saveTo = args.corpus if args.simulate is not None else corpusPath
+    ingester = ingest.Ingester(saveTo, args.prefix, onRecord=server.publish)
+    devices = list(args.devices)
+    tasks = []
+    if args.simulate is not None:
+        records = [item for item in corpus.openCorpus(corpusPath).records() if "A" in item]
+        path, play = simulateBoard(records, args.simulate)
+        devices.append(path)
+        tasks.append(play())
+    httpServer = await asyncio.start_server(server.handle, args.host, args.port)
+    print("serving on http://%s:%d/" % (args.host, args.port), file=sys.stderr)
+    async with httpServer:
+        tasks.append(httpServer.serve_forever())
+        if len(devices) > 0:
+            tasks.append(ingester.run(devices, args.baud))
+        await asyncio.gather(*tasks)
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Serve the plot page with live captures.")
+    argParser.add_argument("devices", nargs="*")
+    argParser.add_argument("--corpus", help="irdata.json or a segment store directory")
+    argParser.add_argument("--baud", type=int, default=9600)
+    argParser.add_argument("--prefix", default="capture", help="id prefix for records without an id")
+    argParser.add_argument("--host", default="localhost")
+    argParser.add_argument("--port", type=int, default=8000)
+    argParser.add_argument("--simulate", type=float, metavar="SECONDS",
+        help="replay the corpus through a simulated capture board at this interval")
+    try:
+        asyncio.run(main(argParser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,130 @@
+import io, json, os, sys
+import numpy as np
+
+import corpus
+
+#The 16-bit duration encoding of ircomm.ino , for whole arrays at once.
+#packDur keeps durations below 0x8000 as they are and stores longer ones (up to
+#0x100000) as 0x8000 | dur >> 5, losing the low 5 bits; anything longer is END.
+#The top three values are markers (CALL, END, WAIT), so durations from 0xFFFA0
+#that would land on them are clamped to 0xFFFC (0xFFF80us), as in the firmware.
+#
+#Also a corpus file format built on it (.npz), which openCorpus accepts: one
+#uint16 column for all the durations, with the few values the codec can't
+#hold exactly kept on the side, so the records read back unchanged.
+
+WAIT = 0xFFFF
+END = 0xFFFE
+CALL = 0xFFFD           #sequence tables only (see seqcompile.py)
+PACKED_MAX = CALL - 1
+RAW_LIMIT = 0x8000
+PACKED_LIMIT = 0x100000
+PACKED_SHIFT = 5
+
+def packDur(durations):
+    durations = np.asarray(durations, dtype=np.int64)
+    packed = np.where(durations < RAW_LIMIT, durations, np.minimum(RAW_LIMIT | (durations >> PACKED_SHIFT), PACKED_MAX))
+    packed = np.where(durations < PACKED_LIMIT, packed, END)
+    return packed.astype(np.uint16)
+
+#no special case for the markers, as in the firmware; see isSentinel
+def unpackDur(packed):
+    packed = np.asarray(packed, dtype=np.uint32)
+    return np.where(packed < RAW_LIMIT, packed, (packed & 0x7FFF) << PACKED_SHIFT)
+
+def isSentinel(packed):
+    packed = np.asarray(packed)
+    return packed >= CALL
+
+#what packing would do to these durations
+def quantizationError(durations):
+    durations = np.asarray(durations, dtype=np.int64)
+    packed = packDur(durations)
+    sentinel = isSentinel(packed)
+    error = unpackDur(packed).astype(np.int64) - durations
+    valid = ~sentinel
+    return {
+        "count": len(durations),
+        "raw": int((durations < RAW_LIMIT).sum()),
+        "shortened": int(((durations >= RAW_LIMIT) & valid).sum()),
+        "lost": int(sentinel.sum()),
+        "maxError": int(np.abs(error[valid]).max()) if valid.any() else 0,
+        "meanError": float(np.abs(error[valid]).mean()) if valid.any() else 0.0,
+        "maxRelativeError": float((np.abs(error[valid]) / np.maximum(durations[valid], 1)).max()) if valid.any() else 0.0,
+    }
+
+#A binary dump of the firmware's logBuffer (little-endian uint16) as a record
+#like the ones ingest.py makes from the printed log, which drops END markers.
+def logRecord(data, itemId="", note=""):
+    packed = np.frombuffer(data, dtype="<u2")
+    durations = unpackDur(packed[~isSentinel(packed)])
+    return {"id": itemId, "note": note, "hasOnTimes": True, "A": durations.tolist()}
+
+def packRecords(items):
+    metadata = []
+    lengths = []
+    columns = []
+    for item in items:
+        metadata.append({key: value for key, value in item.items() if key not in ["A", "B"]})
+        lengths.append([len(item["A"]) if "A" in item else -1, len(item["B"]) if "B" in item else -1])
+        columns.extend(item[channel] for channel in ["A", "B"] if channel in item)
+    durations = np.concatenate([np.asarray(c, dtype=np.int64) for c in columns]) if len(columns) > 0 else np.zeros(0, dtype=np.int64)
+    packed = packDur(durations)
+    inexact = np.flatnonzero(unpackDur(packed) != durations)
+    return {
+        "metadata": np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8),
+        "lengths": np.array(lengths, dtype=np.int32).reshape(-1, 2),
+        "packed": packed,
+        "exceptionIndex": inexact.astype(np.int64),
+        "exceptionValue": durations[inexact],
+    }
+
+def unpackRecords(arrays):
+    metadata = json.loads(arrays["metadata"].tobytes().decode())
+    durations = unpackDur(arrays["packed"]).astype(np.int64)
+    durations[arrays["exceptionIndex"]] = arrays["exceptionValue"]
+    durations = durations.tolist()
+    items = []
+    position = 0
+    for meta, channelLengths in zip(metadata, arrays["lengths"].tolist()):
+        item = dict(meta)
+        for channel, length in zip(["A", "B"], channelLengths):
+            if length >= 0:
+                item[channel] = durations[position:position + length]
+                position += length
+        items.append(item)
+    return items
+
+class PackedFile:
+    def __init__(self, path):
+        self.path = path
+    def records(self):
+        with np.load(self.path) as arrays:
+            return iter(unpackRecords(arrays))
+    def write(self, items):
+        buffer = io.BytesIO()
+        np.savez(buffer, **packRecords(items))
+        corpus.writeAtomic(self.path, buffer.getvalue())
+    def appendRecords(self, items):
+        existing = list(self.records()) if os.path.exists(self.path) else []
+        self.write(existing + list(items))
+    def export(self, path):
+        corpus.writeAtomic(path, corpus.formatFile(list(self.records())))
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "error":
+        items = list(corpus.openCorpus(sys.argv[2] if len(sys.argv) > 2 else corpus.CORPUS_PATH).records())
+        durations = np.concatenate([np.asarray(item[c], dtype=np.int64) for item in items for c in ["A", "B"] if c in item])
+        for key, value in quantizationError(durations).items():
+            print(key, value, sep="\t")
+        print("uint16 bytes", durations.size * 2, sep="\t")
+        print("uint32 bytes", durations.size * 4, sep="\t")
+    elif len(sys.argv) == 4 and sys.argv[1] == "pack":
+        PackedFile(sys.argv[3]).write(list(corpus.openCorpus(sys.argv[2]).records()))
+    elif len(sys.argv) == 4 and sys.argv[1] == "unpack":
+        PackedFile(sys.argv[2]).export(sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "log":
+        with open(sys.argv[2], "rb") as f:
+            print(corpus.formatRecord(logRecord(f.read(), note="log dump " + sys.argv[2])))
+    else:
+        print("error [CORPUS] / pack CORPUS OUT.npz / unpack IN.npz OUT.json / log DUMP.bin")
@@ -0,0 +1,168 @@
+import argparse, sys, time
+import numpy as np
+
+import corpus
+import decode_ic
+import timeline
+
+#Decoded iC packets as columns, one row per packet, for analysis without
+#parsing the text output of decode_ic.py :
+#  record   index into ids (and decodes)
+#  channel  0 for A, 1 for B
+#  packet   position in the channel, from 0 (same order as the text output)
+#  start    time of the packet's first byte, microseconds from the trigger
+#  data     the 16-bit word (after autofix)
+#  checksum redundancy bits as received
+#  status   decode_ic.STATUS_*
+#  fixMask  data bits changed by autofix (0 if the checksum bit was fixed)
+#Building it decodes once; a PacketTable can then be saved as .npz and loaded.
+
+COLUMNS = {
+    "record": np.int32,
+    "channel": np.uint8,
+    "packet": np.int32,
+    "start": np.int64,
+    "data": np.uint16,
+    "checksum": np.uint16,
+    "status": np.uint8,
+    "fixMask": np.uint16,
+}
+
+class PacketTable:
+    def __init__(self, columns, ids, decodes):
+        self.columns = columns
+        self.ids = np.asarray(ids, dtype=str)
+        self.decodes = np.asarray(decodes, dtype=str)
+    def __len__(self):
+        return len(self.columns["record"])
+    def __getitem__(self, name):
+        return self.columns[name]
+    #rows where mask is true, e.g. table.where(table["data"] & 0xF == 7)
+    def where(self, mask):
+        return PacketTable({name: column[mask] for name, column in self.columns.items()}, self.ids, self.decodes)
+    #a per-record value for each row, e.g. recordValues(prefixes(table.ids))
+    def recordValues(self, values):
+        return np.asarray(values)[self.columns["record"]]
+    #counts of each combination of keys (arrays with one value per row);
+    #returns the distinct keys, one array each, and the counts
+    def groupCounts(self, *keys):
+        codes = []
+        uniques = []
+        for key in keys:
+            unique, code = _encode(np.asarray(key))
+            uniques.append(unique)
+            codes.append(code)
+        sizes = [max(len(u), 1) for u in uniques]
+        combined = np.ravel_multi_index(codes, sizes) if len(self) > 0 else np.zeros(0, dtype=np.int64)
+        if np.prod(sizes) <= 1 << 22:
+            counts = np.bincount(combined, minlength=int(np.prod(sizes)))
+            groups = np.flatnonzero(counts)
+            counts = counts[groups]
+        else:
+            groups, counts = np.unique(combined, return_counts=True)
+        indexes = np.unravel_index(groups, sizes)
+        return [u[i] for u, i in zip(uniques, indexes)], counts
+    #{group: {status name: count}}, for a key with one value per record
+    #(the key is encoded per record, not per row)
+    def statusCounts(self, recordKey):
+        unique, code = _encode(np.asarray(recordKey))
+        (groups, statuses), counts = self.groupCounts(code[self.columns["record"]], self.columns["status"])
+        result = {}
+        for group, status, count in zip(unique[groups].tolist(), statuses.tolist(), counts.tolist()):
+            result.setdefault(group, {})[decode_ic.STATUS_NAMES[status]] = count
+        return result
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, ids=self.ids, decodes=self.decodes, **self.columns)
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({name: data[name] for name in COLUMNS}, data["ids"], data["decodes"])
+
+#distinct values and each value's position among them; small integer ranges
+#(status, channel, 16-bit words) are counted directly instead of sorted
+def _encode(key):
+    if np.issubdtype(key.dtype, np.integer) and len(key) > 0 and int(key.max()) - int(key.min()) < 1 << 16:
+        low = int(key.min())
+        unique = np.arange(low, int(key.max()) + 1).astype(key.dtype)
+        return unique, key.astype(np.int64) - low
+    unique, code = np.unique(key, return_inverse=True)
+    return unique, code.reshape(-1)
+
+#Collects rows as channels are decoded, for callers that run the decoders
+#themselves (irtool.py decode ic --table).
+class PacketTableBuilder:
+    def __init__(self):
+        self.rows = []
+        self.ids = []
+        self.decodes = []
+    def addRecord(self, item):
+        self.ids.append(item["id"])
+        self.decodes.append(item.get("decode", ""))
+        return len(self.ids) - 1
+    #decoder2 must have decoded with the byte times from the first step
+    def addChannel(self, record, channel, decoder2):
+        for packetNum, (start, data, checksum, status, fixMask) in enumerate(decoder2.packets):
+            self.rows.append((record, channel, packetNum, start, data, checksum, status, fixMask))
+    def table(self):
+        columns = {}
+        for i, (name, dtype) in enumerate(COLUMNS.items()):
+            columns[name] = np.fromiter((row[i] for row in self.rows), dtype=dtype, count=len(self.rows))
+        return PacketTable(columns, self.ids, self.decodes)
+
+def decodeRecords(records, clean=False, clock=False):
+    builder = PacketTableBuilder()
+    for item in records:
+        if item.get("decode", "") not in ["ic", "ics"]:
+            continue
+        record = builder.addRecord(item)
+        #falling-edge intervals, also for records with on times
+        channels = {channel: timeline.recordIntervals(item, channel) for channel in ["A", "B"] if channel in item}
+        if clean and "B" in item:
+            import crossover
+            channels = crossover.cleanRecord(dict(item, **channels))
+        for channelNum, channel in enumerate(["A", "B"]):
+            if channel in item:
+                tick = decode_ic.estimateTick(channels[channel]) if clock else None
+                _, decoder2 = decode_ic.decodeChannel(channels[channel], tick=tick)
+                builder.addChannel(record, channelNum, decoder2)
+    return builder.table()
+
+#"wha" for "wha-lila-1", "twin" for "twin-battle-gao-agu-1-t2"
+def prefixes(ids):
+    return np.array([itemId.split("-")[0] for itemId in np.asarray(ids).tolist()], dtype=str)
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Build or query the table of decoded iC packets.")
+    commands = argParser.add_subparsers(dest="command", required=True)
+    buildParser = commands.add_parser("build", help="decode the corpus into a table")
+    buildParser.add_argument("table")
+    buildParser.add_argument("--corpus", default=corpus.CORPUS_PATH)
+    buildParser.add_argument("--clean", action="store_true", help="remove A/B crossover first")
+    buildParser.add_argument("--clock", action="store_true", help="fit each trace's tick period first")
+    statusParser = commands.add_parser("status", help="status counts per device prefix")
+    statusParser.add_argument("table")
+    wordsParser = commands.add_parser("words", help="good (and recovered) words where data & MASK == VALUE")
+    wordsParser.add_argument("table")
+    wordsParser.add_argument("mask", type=lambda x: int(x, 0))
+    wordsParser.add_argument("value", type=lambda x: int(x, 0))
+    args = argParser.parse_args()
+    timeStart = time.monotonic()
+    if args.command == "build":
+        table = decodeRecords(corpus.openCorpus(args.corpus).records(), args.clean, args.clock)
+        table.save(args.table)
+        print("%d packets from %d records" % (len(table), len(table.ids)), file=sys.stderr)
+    elif args.command == "status":
+        table = PacketTable.load(args.table)
+        counts = table.statusCounts(prefixes(table.ids))
+        for prefix, statusCounts in sorted(counts.items()):
+            print(prefix, *("%s %d" % (name, statusCounts.get(name, 0)) for name in decode_ic.STATUS_NAMES), sep="\t")
+    elif args.command == "words":
+        table = PacketTable.load(args.table)
+        #recovered packets passed the checksum too, so --recover tables count them
+        good = (table["status"] <= decode_ic.STATUS_AUTOFIX) | (table["status"] == decode_ic.STATUS_RECOVERED)
+        good = table.where(good & (table["data"] & args.mask == args.value))
+        (words,), counts = good.groupCounts(good["data"])
+        for word, count in zip(words.tolist(), counts.tolist()):
+            print("%04X" % word, count, sep="\t")
+    print("%.3f s" % (time.monotonic() - timeStart), file=sys.stderr)
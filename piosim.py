@@ -0,0 +1,377 @@
+import ast, bisect, json, sys
+
+#Host-side simulator for the PIO programs in pycomm/code.py.
+#Covers the instruction subset used there: jmp/wait/in/out/push/pull/mov/set/nop,
+#with delays, autopush/autopull and x/y scratch registers. Side-set is not supported.
+#The OUT, SET and MOV pins are assumed to share a base pin, as in all our programs.
+
+MASK32 = 0xFFFFFFFF
+
+#How doComm sets up each state machine: (program name, frequency, StateMachine kwargs)
+PROGRAM_CONFIGS = {
+    "ic": ("iC_TX_ASM", 100000, {}),
+    "xroslink": ("iC_TX_ASM", 25000, {}),
+    "xros": ("durs_TX_ASM", 1_000_000, {}),
+    "scope240": ("scope240_ASM", 2_000_000, {
+        "in_shift_right": False,
+        "out_shift_right": True,
+        "auto_push": True,
+        "push_threshold": 30,
+    }),
+    "prong": ("prong_TX_ASM", 1_000_000, {
+        "set_pin_count": 2,
+        "initial_set_pin_direction": 0,
+    }),
+}
+
+def _evalStr(node):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.BinOp):
+        left = _evalStr(node.left)
+        right = _evalStr(node.right)
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Mult):
+            return left * right
+    raise ValueError("unsupported expression")
+
+#read the *_ASM strings out of the CircuitPython code without importing it
+def loadPrograms(path="pycomm/code.py"):
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    programs = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+            if isinstance(target, ast.Name) and target.id.endswith("_ASM"):
+                programs[target.id] = _evalStr(node.value)
+    return programs
+
+def assemble(text):
+    instructions = []
+    labels = {}
+    wrapTarget = 0
+    wrap = None
+    for line in text.split("\n"):
+        line = line.split(";")[0].strip()
+        if line == "":
+            continue
+        if line.startswith("."):
+            directive = line.split()[0]
+            if directive == ".wrap_target":
+                wrapTarget = len(instructions)
+            elif directive == ".wrap":
+                wrap = len(instructions) - 1
+            elif directive not in [".program", ".define", ".origin"]:
+                raise ValueError("unsupported directive: " + line)
+            continue
+        if ":" in line.split()[0]:
+            label, _, line = line.partition(":")
+            labels[label.strip()] = len(instructions)
+            line = line.strip()
+            if line == "":
+                continue
+        delay = 0
+        if "[" in line:
+            line, _, delayStr = line.partition("[")
+            delay = int(delayStr.rstrip().rstrip("]"), 0)
+        words = line.replace(",", " ").split()
+        instructions.append([words[0].lower(), [w.lower() for w in words[1:]], delay])
+    for instruction in instructions:
+        op, args, delay = instruction
+        if op == "nop":
+            instruction[0] = "mov"
+            instruction[1] = ["y", "y", ""]
+        elif op == "jmp":
+            target = args[-1]
+            args[-1] = labels[target] if target in labels else int(target, 0)
+            if len(args) == 1:
+                args.insert(0, "always")
+        elif op == "mov":
+            #normalise "mov osr ~ osr", "mov osr ~osr", "mov osr, !osr"
+            source = "".join(args[1:])
+            modifier = ""
+            if source[0] in "~!":
+                modifier, source = "~", source[1:]
+            elif source.startswith("::"):
+                modifier, source = "::", source[2:]
+            instruction[1] = [args[0], source, modifier]
+        elif op in ["in", "out", "set"]:
+            args[1] = int(args[1], 0)
+        elif op == "wait":
+            args[0] = int(args[0], 0)
+            args[2] = int(args[2], 0)
+        elif op not in ["pull", "push", "irq"]:
+            raise ValueError("unsupported instruction: " + op)
+    if wrap is None:
+        wrap = len(instructions) - 1
+    return instructions, wrapTarget, wrap
+
+def _bitmask(bits):
+    return MASK32 if bits >= 32 else (1 << bits) - 1
+
+#Same construction as rp2pio.StateMachine, with the extra input_durations argument
+#giving the waveform on the input pin in irdata.json "hasOnTimes" form (active low).
+class StateMachine:
+    def __init__(self, program, frequency, in_shift_right=True, out_shift_right=True,
+            auto_push=False, push_threshold=32, auto_pull=False, pull_threshold=32,
+            set_pin_count=1, initial_set_pin_direction=None, released_level=1,
+            input_durations=None):
+        if isinstance(program, str):
+            program = assemble(program)
+        self.instructions, self.wrapTarget, self.wrap = program
+        self.frequency = frequency
+        self.inShiftRight = in_shift_right
+        self.outShiftRight = out_shift_right
+        self.autoPush = auto_push
+        self.pushThreshold = push_threshold
+        self.autoPull = auto_pull
+        self.pullThreshold = pull_threshold
+        self.pinMask = _bitmask(set_pin_count)
+        if initial_set_pin_direction is None:
+            initial_set_pin_direction = self.pinMask
+        self.releasedLevel = released_level
+        self.inputEdges = []
+        if input_durations is not None:
+            t = 0
+            for dur in input_durations:
+                t += dur
+                self.inputEdges.append(t)
+        self.txFifo = []
+        self.rxFifo = []
+        self.pc = 0
+        self.cycle = 0
+        self.x = 0
+        self.y = 0
+        self.isr = 0
+        self.isrCount = 0
+        self.osr = 0
+        self.osrCount = 32
+        self.pins = 0
+        self.pindirs = initial_set_pin_direction & self.pinMask
+        self.level = self.observedLevel()
+        self.idleLevel = self.level
+        self.transitions = []
+        self.stalled = False
+    def write(self, words):
+        self.txFifo.extend(w & MASK32 for w in words)
+    def read(self):
+        result = self.rxFifo
+        self.rxFifo = []
+        return result
+    def observedLevel(self):
+        if self.pindirs & 1:
+            return self.pins & 1
+        return self.releasedLevel
+    def inputLevel(self, cycle):
+        #odd-numbered segments are IR on, which pulls the receiver low
+        segment = bisect.bisect_right(self.inputEdges, cycle * 1_000_000 / self.frequency)
+        if segment >= len(self.inputEdges):
+            return 1
+        return 0 if segment % 2 else 1
+    def nextInputCycle(self, level):
+        #first cycle >= now at which the input pin has the given level, or None
+        if self.inputLevel(self.cycle) == level:
+            return self.cycle
+        t = self.cycle * 1_000_000 / self.frequency
+        for edge in self.inputEdges[bisect.bisect_right(self.inputEdges, t):]:
+            cycle = -(-edge * self.frequency // 1_000_000)
+            if self.inputLevel(cycle) == level:
+                return int(cycle)
+        return None
+    def setPins(self, value, mask):
+        self.pins = (self.pins & ~mask) | (value & mask)
+        self.updateLevel()
+    def setPindirs(self, value):
+        self.pindirs = value & self.pinMask
+        self.updateLevel()
+    def updateLevel(self):
+        level = self.observedLevel()
+        if level != self.level:
+            self.transitions.append(self.cycle)
+            self.level = level
+    def readSource(self, source):
+        if source == "pins":
+            return self.inputLevel(self.cycle)
+        elif source == "x":
+            return self.x
+        elif source == "y":
+            return self.y
+        elif source == "null":
+            return 0
+        elif source == "isr":
+            return self.isr
+        elif source == "osr":
+            return self.osr
+        elif source == "status":
+            return MASK32 if len(self.txFifo) == 0 else 0
+        raise ValueError("unsupported source: " + source)
+    def writeDest(self, dest, value, bitCount):
+        value &= MASK32
+        if dest == "pins":
+            self.setPins(value, _bitmask(bitCount) & self.pinMask)
+        elif dest == "x":
+            self.x = value
+        elif dest == "y":
+            self.y = value
+        elif dest == "pindirs":
+            self.setPindirs(value)
+        elif dest == "pc":
+            self.pc = value
+            return True
+        elif dest == "isr":
+            self.isr = value
+            self.isrCount = bitCount
+        elif dest == "osr":
+            self.osr = value
+            self.osrCount = 0
+        elif dest != "null":
+            raise ValueError("unsupported destination: " + dest)
+        return False
+    def push(self):
+        self.rxFifo.append(self.isr)
+        self.isr = 0
+        self.isrCount = 0
+    def pull(self, block):
+        if len(self.txFifo) > 0:
+            self.osr = self.txFifo.pop(0)
+        elif block:
+            return False
+        else:
+            self.osr = self.x
+        self.osrCount = 0
+        return True
+    def condition(self, cond):
+        if cond == "always":
+            return True
+        elif cond == "!x":
+            return self.x == 0
+        elif cond == "x--":
+            result = self.x != 0
+            self.x = (self.x - 1) & MASK32
+            return result
+        elif cond == "!y":
+            return self.y == 0
+        elif cond == "y--":
+            result = self.y != 0
+            self.y = (self.y - 1) & MASK32
+            return result
+        elif cond == "x!=y":
+            return self.x != self.y
+        elif cond == "pin":
+            return self.inputLevel(self.cycle) == 1
+        elif cond == "!osre":
+            return self.osrCount < self.pullThreshold
+        raise ValueError("unsupported condition: " + cond)
+    #execute one instruction; returns False if the state machine stalled for good
+    def step(self):
+        op, args, delay = self.instructions[self.pc]
+        jumped = False
+        if op == "jmp":
+            cond, target = args
+            if target == self.pc and cond in ["x--", "y--"]:
+                #skip a whole countdown loop at once
+                reg = cond[0]
+                count = getattr(self, reg)
+                self.cycle += count * (1 + delay)
+                setattr(self, reg, 0)
+            if self.condition(cond):
+                self.pc = target
+                jumped = True
+        elif op == "wait":
+            polarity, source, index = args
+            if source not in ["pin", "gpio"]:
+                raise ValueError("unsupported wait source: " + source)
+            cycle = self.nextInputCycle(polarity)
+            if cycle is None:
+                return False
+            self.cycle = cycle
+        elif op == "in":
+            source, bitCount = args
+            data = self.readSource(source) & _bitmask(bitCount)
+            if self.inShiftRight:
+                self.isr = (self.isr >> bitCount) | (data << (32 - bitCount)) & MASK32
+            else:
+                self.isr = ((self.isr << bitCount) | data) & MASK32
+            self.isrCount = min(self.isrCount + bitCount, 32)
+            if self.autoPush and self.isrCount >= self.pushThreshold:
+                self.push()
+        elif op == "out":
+            dest, bitCount = args
+            if self.autoPull and self.osrCount >= self.pullThreshold:
+                if not self.pull(True):
+                    return False
+            if self.outShiftRight:
+                data = self.osr & _bitmask(bitCount)
+                self.osr = self.osr >> bitCount if bitCount < 32 else 0
+            else:
+                data = self.osr >> (32 - bitCount)
+                self.osr = (self.osr << bitCount) & MASK32
+            self.osrCount = min(self.osrCount + bitCount, 32)
+            jumped = self.writeDest(dest, data, bitCount)
+        elif op == "push":
+            if "iffull" not in args or self.isrCount >= self.pushThreshold:
+                self.push()
+        elif op == "pull":
+            if "ifempty" not in args or self.osrCount >= self.pullThreshold:
+                if not self.pull("noblock" not in args):
+                    return False
+        elif op == "mov":
+            dest, source, modifier = args
+            value = self.readSource(source)
+            if modifier == "~":
+                value = ~value & MASK32
+            elif modifier == "::":
+                value = int("{:032b}".format(value)[::-1], 2)
+            jumped = self.writeDest(dest, value, 32)
+        elif op == "set":
+            dest, value = args
+            if dest == "pins":
+                self.setPins(value, self.pinMask)
+            elif dest == "pindirs":
+                self.setPindirs(value)
+            else:
+                self.writeDest(dest, value, 5)
+        self.cycle += 1 + delay
+        if not jumped:
+            self.pc = self.wrapTarget if self.pc == self.wrap else self.pc + 1
+        return True
+    def run(self, maxCycles=100_000_000):
+        while self.cycle < maxCycles:
+            if not self.step():
+                self.stalled = True
+                break
+        return self.getDurations()
+    def cyclesToMicros(self, cycles):
+        return round(cycles * 1_000_000 / self.frequency)
+    #output waveform in irdata.json "hasOnTimes" form: 0, on, off, on, off...
+    #where "on" is the level opposite to the one the pin started at
+    def getDurations(self):
+        transitions = self.transitions
+        if self.level != self.idleLevel:
+            transitions = transitions + [self.cycle]
+        result = [0]
+        times = [self.cyclesToMicros(c) for c in transitions]
+        for i in range(1, len(times)):
+            result.append(times[i] - times[i-1])
+        return result
+
+def simulate(configName, words, programs=None, **kwargs):
+    if programs is None:
+        programs = loadPrograms()
+    programName, frequency, smKwargs = PROGRAM_CONFIGS[configName]
+    smKwargs = dict(smKwargs, **kwargs)
+    sm = StateMachine(programs[programName], frequency, **smKwargs)
+    sm.write(words)
+    durations = sm.run()
+    return durations, sm.read()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in PROGRAM_CONFIGS:
+        print("usage: piosim.py %s [words...]" % "/".join(PROGRAM_CONFIGS))
+    else:
+        durations, received = simulate(sys.argv[1], [int(w, 0) for w in sys.argv[2:]])
+        print(json.dumps(durations))
+        if len(received) > 0:
+            print(" ".join("%08X" % w for w in received))
@@ -0,0 +1,228 @@
+import argparse, concurrent.futures, os, struct, sys, time, zlib
+from xml.sax.saxutils import escape
+import numpy as np
+
+import corpus
+import timeline
+
+#Batch rendering of trace plots to SVG or PNG without a browser.
+#Follows irplot.js: LineMaker is a port of the function of the same name, so the
+#plots line up with the interactive page. The traces come from the edge
+#timeline cache (timeline.py), which also has the packets.
+#Each series is decimated to at most four points per pixel column (first, min,
+#max, last), so a long trace costs about as much as its width in pixels.
+
+COLORS = ["#4c78a8", "#f58518", "#e45756", "#72b7b2", "#54a24b", "#eeca3b", "#b279a2", "#ff9da6", "#9d755d", "#bab0ac"]
+MARGIN_LEFT = 160
+MARGIN_RIGHT = 10
+MARGIN_TOP = 10
+MARGIN_BOTTOM = 30
+PULSE = 1           #width of pulses whose off edge wasn't captured
+
+class LineMaker:
+    def __init__(self, height, yStep):
+        self.height = height
+        self.yStep = yStep
+        self.series = []
+        self.markers = []
+        self.labels = []
+        self.y = 0
+        self.rows = 0
+    def add(self, times, levels, name, label, decode):
+        y = self.y
+        #an on edge with no off edge after it (only falling edges were captured)
+        #is drawn as a pulse PULSE wide, or half the time to the next edge
+        on = levels == 1
+        pulse = on & np.r_[on[1:], len(on) < 2 or on[-2]][:len(on)]
+        gaps = np.r_[np.diff(times.astype(np.int64)), 2 * PULSE]
+        counts = 1 + pulse
+        points = np.repeat(times.astype(np.float64), counts)
+        pointLevels = np.repeat(levels, counts)
+        offPoints = (np.cumsum(counts) - 1)[pulse]
+        points[offPoints] += np.minimum(PULSE, gaps[pulse] / 2)
+        pointLevels[offPoints] = 0
+        #points start off at x=0, as in irplot.js
+        xs = np.r_[-100, 0, points]
+        pointLevels = np.r_[0, 0, pointLevels]
+        ys = np.where(pointLevels == 1, y + self.height, y)
+        self.series.append((name, xs, ys))
+        if decode == "ic" or decode == "ics":
+            #8 bit markers after each off->on point more than 860us after the previous one
+            prevXtoOn = -2000
+            for x in xs[1:][pointLevels[1:] == 0].tolist():
+                if x - prevXtoOn > 860:
+                    for j in range(1, 9):
+                        self.markers.append((x + 100*j, y + self.height/2))
+                    prevXtoOn = x
+        if label is not None:
+            self.labels.append((y, label))
+            self.y -= self.yStep
+            self.rows += 1
+    def count(self):
+        return self.rows
+
+#same choices as plot() in irplot.js for one record
+#edges is {channel: (times, levels, packet starts)} from timeline.py
+def makeLines(item, edges, packetNum=0, channel="below", label="id"):
+    lm = LineMaker(10, 15)
+    itemId = item["id"]
+    text = itemId
+    if label in ["shotSizeA", "wasHitA"] and item.get(label):
+        text = itemId + " " + item[label]
+    empty = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int32))
+    edgesA = timeline.packet(*edges.get("A", empty), packetNum)
+    edgesB = timeline.packet(*edges.get("B", empty), packetNum)
+    decode = item.get("decode")
+    if channel == "A" or "B" not in edges:
+        lm.add(*edgesA, itemId + " (A)", text, decode)
+    elif channel == "B":
+        lm.add(*edgesB, itemId + " (B)", text, decode)
+    elif channel == "below":
+        lm.add(*edgesA, itemId + " (A)", text + " (A)", decode)
+        lm.add(*edgesB, itemId + " (B)", text + " (B)", decode)
+    else:
+        lm.add(*edgesA, itemId + " (A)", None, decode)
+        lm.add(*edgesB, itemId + " (B)", text, decode)
+    return lm
+
+#keep first, min, max and last point of each run of points in the same pixel column
+def decimate(px, ys):
+    if len(px) == 0:
+        return px, ys
+    starts = np.r_[0, np.flatnonzero(np.diff(px)) + 1]
+    ends = np.r_[starts[1:], len(px)] - 1
+    columns = np.stack([ys[starts], np.minimum.reduceat(ys, starts), np.maximum.reduceat(ys, starts), ys[ends]], axis=1)
+    return np.repeat(px[starts], 4), columns.reshape(-1)
+
+class Layout:
+    def __init__(self, lm, width):
+        self.width = width
+        self.height = lm.count() * 50 + 1 + MARGIN_TOP + MARGIN_BOTTOM
+        self.xMin = -100
+        self.xMax = max([int(xs[-1]) for _, xs, _ in lm.series] + [0]) + 100
+        self.yMin = lm.y + lm.yStep - 1
+        self.yMax = lm.height + 1
+        self.xScale = (width - MARGIN_LEFT - MARGIN_RIGHT) / (self.xMax - self.xMin)
+        self.yScale = (self.height - MARGIN_TOP - MARGIN_BOTTOM) / (self.yMax - self.yMin)
+    def px(self, x):
+        return np.round(MARGIN_LEFT + (np.asarray(x) - self.xMin) * self.xScale).astype(np.int64)
+    def py(self, y):
+        return np.round(MARGIN_TOP + (self.yMax - np.asarray(y)) * self.yScale).astype(np.int64)
+    def series(self, xs, ys):
+        return decimate(self.px(xs), self.py(ys))
+
+def renderSvg(lm, width):
+    layout = Layout(lm, width)
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="sans-serif" font-size="10">' % (width, layout.height),
+        '<rect width="100%" height="100%" fill="white"/>']
+    for i, (name, xs, ys) in enumerate(lm.series):
+        px, py = layout.series(xs, ys)
+        path = ["M%d %d" % (px[0], py[0])]
+        for x, y in zip(px[1:].tolist(), py[1:].tolist()):
+            path.append("H%dV%d" % (x, y))
+        parts.append('<path d="%s" fill="none" stroke="%s" stroke-width="1"><title>%s</title></path>'
+            % ("".join(path), COLORS[i % len(COLORS)], escape(name)))
+    if len(lm.markers) > 0:
+        markers = np.array(lm.markers)
+        mx = layout.px(markers[:, 0])
+        my = layout.py(markers[:, 1])
+        for x, y in sorted(set(zip(mx.tolist(), my.tolist()))):
+            parts.append('<circle cx="%d" cy="%d" r="2.5" fill="none" stroke="black" stroke-width="0.7"/>' % (x, y))
+    for y, label in lm.labels:
+        parts.append('<text x="%d" y="%d" text-anchor="end">%s</text>' % (MARGIN_LEFT - 5, layout.py(y), escape(label)))
+    axisY = layout.height - MARGIN_BOTTOM + 5
+    parts.append('<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="#888"/>' % (MARGIN_LEFT, axisY, width - MARGIN_RIGHT, axisY))
+    for tick in np.linspace(0, layout.xMax - 100, 6):
+        tick = int(round(tick, -2))
+        parts.append('<text x="%d" y="%d" text-anchor="middle">%d</text>' % (layout.px(tick), axisY + 12, tick))
+    parts.append('<text x="%d" y="%d" text-anchor="middle">time (microseconds)</text>' % ((MARGIN_LEFT + width) // 2, axisY + 24))
+    parts.append("</svg>\n")
+    return "\n".join(parts).encode()
+
+#pixel coordinates covering the segments lo[i]..hi[i] (inclusive) along one axis
+def _spans(lo, hi):
+    lengths = hi - lo + 1
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(lo, lengths) + offsets, np.repeat(np.arange(len(lo)), lengths)
+
+#PNG without labels, drawn directly: a step plot is only horizontal and vertical lines
+def renderPng(lm, width):
+    layout = Layout(lm, width)
+    image = np.full((layout.height, width, 3), 255, dtype=np.uint8)
+    for i, (name, xs, ys) in enumerate(lm.series):
+        color = [int(COLORS[i % len(COLORS)][j:j+2], 16) for j in [1, 3, 5]]
+        px, py = layout.series(xs, ys)
+        px = np.clip(px, 0, width - 1)
+        py = np.clip(py, 0, layout.height - 1)
+        x0, x1, y0, y1 = px[:-1], px[1:], py[:-1], py[1:]
+        cols, segment = _spans(x0, x1)
+        image[y0[segment], cols] = color
+        rows, segment = _spans(np.minimum(y0, y1), np.maximum(y0, y1))
+        image[rows, x1[segment]] = color
+    if len(lm.markers) > 0:
+        markers = np.array(lm.markers)
+        mx = layout.px(markers[:, 0])
+        my = layout.py(markers[:, 1])
+        keep = (mx >= 2) & (mx < width - 2)
+        mx, my = mx[keep], my[keep]
+        for dy in range(-2, 3):
+            for dx in range(-2, 3):
+                if max(abs(dx), abs(dy)) == 2:
+                    image[my + dy, mx + dx] = 0
+    raw = np.concatenate([np.zeros((layout.height, 1), dtype=np.uint8), image.reshape(layout.height, -1)], axis=1)
+    def chunk(kind, data):
+        return struct.pack("!I", len(data)) + kind + data + struct.pack("!I", zlib.crc32(kind + data))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack("!IIBBBBB", width, layout.height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 1)) + chunk(b"IEND", b""))
+
+def safeName(itemId):
+    return "".join(c if c.isalnum() or c in "-_~" else "_" for c in itemId)
+
+#render one record (and optionally each of its packets); returns files written
+def renderRecord(item, edges, outDir, fileFormat, width, channel, perPacket):
+    render = renderSvg if fileFormat == "svg" else renderPng
+    packets = [0]
+    if perPacket:
+        packets = range(1, len(edges["A"][2]) + 1)
+    written = []
+    for packetNum in packets:
+        lm = makeLines(item, edges, packetNum, channel)
+        suffix = "" if packetNum == 0 else "-p%d" % packetNum
+        path = os.path.join(outDir, safeName(item["id"]) + suffix + "." + fileFormat)
+        with open(path, "wb") as f:
+            f.write(render(lm, width))
+        written.append(path)
+    return written
+
+def _renderJob(args):
+    return renderRecord(*args)
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Write a plot file per record, like the irplot page.")
+    argParser.add_argument("outdir")
+    argParser.add_argument("ids", nargs="*", help="records to plot (default all)")
+    argParser.add_argument("--corpus", default=corpus.CORPUS_PATH)
+    argParser.add_argument("--format", choices=["svg", "png"], default="svg")
+    argParser.add_argument("--width", type=int, default=1600)
+    argParser.add_argument("--channel", choices=["A", "B", "below", "overlap"], default="below")
+    argParser.add_argument("--packets", action="store_true", help="one file per packet instead of per record")
+    argParser.add_argument("--jobs", type=int, default=None, help="worker processes (default one per CPU)")
+    args = argParser.parse_args()
+    os.makedirs(args.outdir, exist_ok=True)
+    wanted = set(args.ids)
+    seen = set()
+    jobs = []
+    timelines = timeline.load(args.corpus)
+    for record, item in enumerate(corpus.openCorpus(args.corpus).records()):
+        if (len(wanted) == 0 or item["id"] in wanted) and item["id"] not in seen:
+            seen.add(item["id"])
+            labels = {key: value for key, value in item.items() if key not in timeline.CHANNELS}
+            edges = {channel: (*timelines.channel(record, channel), timelines.packetStarts(record, channel))
+                for channel in timeline.CHANNELS if timelines.has(record, channel)}
+            jobs.append((labels, edges, args.outdir, args.format, args.width, args.channel, args.packets))
+    timeStart = time.monotonic()
+    count = 0
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+        for written in executor.map(_renderJob, jobs, chunksize=8):
+            count += len(written)
+    print("%d files in %.2f s" % (count, time.monotonic() - timeStart), file=sys.stderr)
@@ -0,0 +1,99 @@
+import sys, time
+import numpy as np
+
+import corpus
+import timeline
+
+#Guessing which protocol a trace uses, from a few duration features, so records
+#without a "decode" field can go to the right decoder (or to none).
+#classify() returns (family, confidence, scores): every family gets a score from
+#0 to 1, and the confidence is how far the best is ahead of the runner-up.
+#Families that have a decoder use the names of the "decode" field.
+
+PACKET_GAP = 15000
+MIN_SCORE = 0.5
+
+#start pulse and the gap after it, for protocols that begin packets that way
+START_PULSES = {
+    "datalink": (9800, 2450),
+    "fusion": (5880, 3870),
+    "talis": (3890, 3950),
+    "tamacon": (9575, 6000),
+}
+#tick length and margin, for protocols that send ticks between falling edges
+TICK_LATTICES = {
+    "ic": (100, 30),
+    "xroslink": (400, 100),
+}
+WITCHES_UNIT = 19520
+
+#falling-edge intervals, and on and off times if the record has them
+def durationArrays(item):
+    times, levels = timeline.edges(item["A"], item.get("hasOnTimes", False))
+    intervals = np.asarray(timeline.intervals(times, levels), dtype=np.int64)
+    if item.get("hasOnTimes"):
+        #each time between edges is on or off by the level it starts at
+        gaps = np.diff(times.astype(np.int64))
+        return intervals, gaps[levels[:-1] == 1], gaps[levels[:-1] == 0]
+    return intervals, None, None
+
+#fraction of the (non-gap) intervals within margin of 1 to 8 ticks
+def latticeScore(intervals, tick, margin):
+    intervals = intervals[1:]
+    intervals = intervals[intervals < PACKET_GAP]
+    if len(intervals) == 0:
+        return 0.0
+    ticks = np.round(intervals / tick)
+    fits = (ticks >= 1) & (ticks <= 8) & (np.abs(intervals - ticks * tick) <= margin)
+    return float(fits.mean())
+
+#fraction of packets that start with this pulse and gap (within 15%)
+def startPulseScore(on, off, pulse, gap):
+    count = min(len(on), len(off))
+    if count == 0:
+        return 0.0
+    on = on[:count]
+    off = off[:count]
+    #packets start at the first pulse and after each long gap
+    starts = np.r_[0, np.flatnonzero(off[:-1] > PACKET_GAP) + 1]
+    fits = (np.abs(on[starts] - pulse) <= 0.15 * pulse) & (np.abs(off[starts] - gap) <= 0.15 * gap)
+    return float(fits.mean())
+
+def scores(item):
+    intervals, on, off = durationArrays(item)
+    result = {}
+    for family, (tick, margin) in TICK_LATTICES.items():
+        #a lattice also fits multiples of itself, so ask for the typical interval too
+        typical = np.median(intervals[1:]) if len(intervals) > 1 else 0
+        plausible = tick * 0.6 <= typical <= tick * 2.5
+        result[family] = latticeScore(intervals, tick, margin) if plausible else 0.0
+    for family, (pulse, gap) in START_PULSES.items():
+        result[family] = startPulseScore(on, off, pulse, gap) if on is not None else 0.0
+    if on is not None:
+        both = np.concatenate([on[1:], off])
+        both = both[both < 8 * WITCHES_UNIT]
+        #Witches pulses and gaps are roughly 1 to 5 units; everything else is far shorter
+        result["witches"] = float(((both > 0.4 * WITCHES_UNIT) & (both < 5.5 * WITCHES_UNIT)).mean()) if len(both) > 0 else 0.0
+        #Xros Loader traces are in units of a few microseconds
+        result["xros"] = float((both < 100).mean()) if len(both) > 0 else 0.0
+    else:
+        result["witches"] = 0.0
+        result["xros"] = 0.0
+    return result
+
+def classify(item):
+    familyScores = scores(item)
+    ranked = sorted(familyScores.items(), key=lambda x: -x[1])
+    best, bestScore = ranked[0]
+    confidence = bestScore - ranked[1][1]
+    if bestScore < MIN_SCORE:
+        return "unknown", confidence, familyScores
+    return best, confidence, familyScores
+
+if __name__ == "__main__":
+    records = [item for item in corpus.openCorpus(sys.argv[1] if len(sys.argv) > 1 else corpus.CORPUS_PATH).records() if "A" in item]
+    timeStart = time.monotonic()
+    for item in records:
+        family, confidence, _ = classify(item)
+        print(item["id"], family, "%.2f" % confidence, item.get("decode", ""), sep="\t")
+    print("%d records in %.3f s" % (len(records), time.monotonic() - timeStart), file=sys.stderr)
@@ -0,0 +1,219 @@
+import argparse, bisect, sys, time
+
+import decode_ic
+
+#Another try at iC packets that don't decode, by guessing what went wrong with
+#the trace: a missed edge (split an interval), a spurious edge (merge two
+#intervals) or an edge a little out of place (move it so the interval is a whole
+#number of ticks). Hypotheses are searched depth-first along the packet with the
+#decoder's state carried along, so the part before a repair is decoded once;
+#a branch is cut as soon as its bytes can't be a packet (a byte error, a wrong
+#preamble byte, too many bytes), and states already tried are remembered.
+#A hypothesis is accepted when the checksum matches (no autofix), and only if
+#all hypotheses with the fewest repairs agree on the data. Each packet gets a
+#time budget, and the search gives up when it runs out.
+#Works on the stretches of a trace between long gaps, when such a stretch holds
+#one packet that failed; most do.
+
+BUDGET = 0.05       #seconds per packet
+MAX_REPAIRS = 1     #with two, wrong packets pass the checksum too often
+MAX_BYTES = 23      #preamble, 4 bytes that may all be escaped, C1
+START_SEQUENCE = decode_ic.iC_decoder_step2().startSequence
+
+class OutOfTime(Exception):
+    pass
+
+#state after some intervals: (pulses, current byte, bytes so far), as in iC_decoder
+def step(state, dur, tickLength, tickMargin):
+    pulses, currentByte, bytes = state
+    ticks = round(dur / tickLength)
+    if pulses + ticks >= 9:
+        for i in range(8 - pulses):
+            currentByte = (currentByte >> 1) | 0x80
+        bytes = bytes + (currentByte,)
+        if not plausible(bytes):
+            return None
+        return (0, 0, bytes)
+    if abs(dur - ticks * tickLength) > tickMargin:
+        return None
+    for i in range(ticks - 1):
+        currentByte = (currentByte >> 1) | 0x80
+    return (pulses + ticks, currentByte >> 1, bytes)
+
+def finish(state):
+    pulses, currentByte, bytes = state
+    if pulses == 0:
+        return bytes
+    for i in range(8 - pulses):
+        currentByte = (currentByte >> 1) | 0x80
+    return bytes + (currentByte,)
+
+#whether these bytes can still be the start of one packet
+def plausible(bytes):
+    start = 0
+    while start < len(bytes) and bytes[start] == 0xFF:
+        start += 1
+    body = bytes[start:]
+    if len(body) > MAX_BYTES:
+        return False
+    for i, b in enumerate(body[:len(START_SEQUENCE)]):
+        if b != START_SEQUENCE[i]:
+            return False
+    payload = body[len(START_SEQUENCE):]
+    for i, b in enumerate(payload):
+        if b == 0xC1 and (i == 0 or payload[i-1] != 0x7D):
+            return i == len(payload) - 1
+        if i > 0 and payload[i-1] == 0x7D and b not in [0xE0, 0xE1]:
+            return False
+    return True
+
+#(data, checksum) if the bytes are one packet that checks out, else None
+def checkedPacket(bytes):
+    decoder2 = decode_ic.iC_decoder_step2()
+    decoder2.decode(list(bytes))
+    if len(decoder2.packets) == 1 and decoder2.packets[0][3] == decode_ic.STATUS_OK:
+        return decoder2.packets[0][1:3]
+    return None
+
+#the repairs that can be made at interval i: (description, intervals used, new intervals)
+def repairs(intervals, i, tickLength):
+    dur = intervals[i]
+    ticks = round(dur / tickLength)
+    result = []
+    for k in range(1, ticks):
+        result.append(("split@%d" % i, 1, (k * tickLength, dur - k * tickLength)))
+    if i + 1 < len(intervals):
+        following = intervals[i+1]
+        result.append(("merge@%d" % i, 2, (dur + following,)))
+        for target in [ticks - 1, ticks, ticks + 1]:
+            moved = target * tickLength
+            if target >= 1 and moved != dur and 0 < following + dur - moved:
+                result.append(("move@%d" % i, 2, (moved, following + dur - moved)))
+    return result
+
+class Search:
+    def __init__(self, intervals, tickLength, tickMargin, deadline):
+        self.intervals = intervals
+        self.tickLength = tickLength
+        self.tickMargin = tickMargin
+        self.deadline = deadline
+        self.tried = set()
+        self.found = {}
+    #every way to decode intervals[i:] from state with up to `repairs` repairs
+    def run(self, i, state, budget, path):
+        intervals = self.intervals
+        while True:
+            if time.monotonic() > self.deadline:
+                raise OutOfTime()
+            if budget > 0 and i < len(intervals):
+                key = (i, state, budget)
+                if key not in self.tried:
+                    self.tried.add(key)
+                    for description, used, replacement in repairs(intervals, i, self.tickLength):
+                        repaired = state
+                        for dur in replacement:
+                            repaired = step(repaired, dur, self.tickLength, self.tickMargin)
+                            if repaired is None:
+                                break
+                        if repaired is not None:
+                            self.run(i + used, repaired, budget - 1, path + [description])
+            if i == len(intervals):
+                packet = checkedPacket(finish(state))
+                if packet is not None and budget == 0:
+                    self.found.setdefault(packet, path)
+                return
+            state = step(state, intervals[i], self.tickLength, self.tickMargin)
+            if state is None:
+                return
+            i += 1
+
+#(data, checksum, repairs) for the intervals of one failed packet, or None
+def recoverSegment(intervals, params=None, tick=None, budget=BUDGET, maxRepairs=MAX_REPAIRS):
+    params = params if params is not None else decode_ic.IC_PARAMS
+    tickLength = tick if tick is not None else params.tickLength
+    tickMargin = params.tickMargin * tickLength / params.tickLength
+    search = Search(intervals, tickLength, tickMargin, time.monotonic() + budget)
+    try:
+        #fewest repairs first; exactly that many at each level
+        for repairCount in range(1, maxRepairs + 1):
+            search.run(0, (0, 0, ()), repairCount, [])
+            if len(search.found) > 0:
+                break
+    except OutOfTime:
+        return None
+    if len(search.found) != 1:
+        return None
+    (data, chk), path = next(iter(search.found.items()))
+    return data, chk, path
+
+#stretches of intervals between long gaps, with the time each starts
+def segments(durations, params):
+    result = []
+    t = durations[0]
+    current = []
+    start = t
+    for dur in durations[1:]:
+        if dur > params.longGap:
+            result.append((start, current))
+            current = []
+            start = t + dur
+        else:
+            current.append(dur)
+        t += dur
+    result.append((start, current))
+    return [(start, intervals) for start, intervals in result if len(intervals) > 0]
+
+#Decodes like iC_decoder_step2 after iC_decoder, then tries the failed packets
+#again; returns the decoder2 with its result and packets updated, and the
+#number of packets recovered.
+def decodeWithRecovery(durations, tick=None, budget=BUDGET, maxRepairs=MAX_REPAIRS):
+    params = decode_ic.IC_PARAMS
+    _, decoder2 = decode_ic.decodeChannel(durations, params, tick)
+    failed = [i for i, packet in enumerate(decoder2.packets) if packet[3] > decode_ic.STATUS_AUTOFIX]
+    if len(failed) == 0:
+        return decoder2, 0
+    recovered = 0
+    starts = [start for start, _ in segments(durations, params)]
+    bySegment = {}
+    for i, packet in enumerate(decoder2.packets):
+        bySegment.setdefault(bisect.bisect_right(starts, packet[0]) - 1, []).append(i)
+    for segmentNum, (start, intervals) in enumerate(segments(durations, params)):
+        rows = bySegment.get(segmentNum, [])
+        if len(rows) != 1 or rows[0] not in failed:
+            continue
+        result = recoverSegment(intervals, params, tick, budget, maxRepairs)
+        if result is None:
+            continue
+        data, chk, path = result
+        row = rows[0]
+        decoder2.result[row] = "%04X recovered %s" % (data, " ".join(path))
+        decoder2.packets[row] = (start, data, chk, decode_ic.STATUS_RECOVERED, 0)
+        recovered += 1
+    return decoder2, recovered
+
+if __name__ == "__main__":
+    import corpus, timeline
+    argParser = argparse.ArgumentParser(description="Try the iC packets that fail again, repairing the trace.")
+    argParser.add_argument("--corpus", default=corpus.CORPUS_PATH)
+    argParser.add_argument("--budget", type=float, default=BUDGET, help="seconds per packet")
+    argParser.add_argument("--max-repairs", type=int, default=MAX_REPAIRS)
+    argParser.add_argument("--clock", action="store_true", help="fit each trace's tick period first")
+    args = argParser.parse_args()
+    timeStart = time.monotonic()
+    failedTotal = 0
+    recoveredTotal = 0
+    for item in corpus.openCorpus(args.corpus).records():
+        if item.get("decode", "") not in ["ic", "ics"]:
+            continue
+        for channel in ["A", "B"]:
+            if channel not in item:
+                continue
+            durations = timeline.recordIntervals(item, channel)
+            tick = decode_ic.estimateTick(durations) if args.clock else None
+            decoder2, recovered = decodeWithRecovery(durations, tick, args.budget, args.max_repairs)
+            failedTotal += sum(1 for packet in decoder2.packets if packet[3] > decode_ic.STATUS_AUTOFIX) + recovered
+            recoveredTotal += recovered
+            for text, packet in zip(decoder2.result, decoder2.packets):
+                if packet[3] == decode_ic.STATUS_RECOVERED:
+                    print(item["id"], channel, text, sep="\t")
+    print("%d of %d failed packets recovered in %.2f s" % (recoveredTotal, failedTotal, time.monotonic() - timeStart), file=sys.stderr)
@@ -0,0 +1,238 @@
+import argparse, json, os, sys
+
+import corpus
+import packdur
+
+#Builds the sequence tables of ircomm from a JSON list of sequences, so they
+#don't have to be written out by hand. Each sequence has a name, a description
+#(the menu text), "modulated", "goFirst", "replyDelay" and "packets", or instead
+#"pycomm": a sequence name from pycomm/code.py, which gives all of those.
+#A packet is one of:
+#  [on, off, on, ...]                      durations in microseconds
+#  {"bytes": [...], "type": "ic"}          as sent by pycomm (ic, xroslink, datalink, fusion)
+#  {"record": id, "channel": "A"}          every packet of a corpus record
+#  {"record": id, "packets": [0, 2]}       some of them
+#Durations are stored with packDur, so long gaps fit in 16 bits. Packets that
+#appear more than once, and long runs that several packets start with (the iC
+#preamble), go in shared sub-tables that the sequences point to with CALL.
+
+CALL = packdur.CALL
+MIN_SHARED = 8          #words; shorter prefixes cost more to point to than they save
+ON_TIME = 20            #given to records with only falling edges
+PACKET_GAP = 15000
+REPLY_DELAYS = {True: 20000, False: 2000}
+PYCOMM_TYPES = {0: "datalink", 1: "fusion", 2: "ic", 4: "xroslink"}
+VALUES_PER_LINE = 24
+
+def recordPackets(item, channel="A"):
+    durations = item[channel]
+    if item.get("hasOnTimes"):
+        pairs = durations[1:]
+    else:
+        pairs = []
+        for interval in durations[1:]:
+            pairs.extend([ON_TIME, interval - ON_TIME])
+        pairs.append(ON_TIME)
+    packets = [[]]
+    for i, duration in enumerate(pairs):
+        if i % 2 == 1 and duration > PACKET_GAP:
+            packets.append([])
+        else:
+            packets[-1].append(duration)
+    return [packet for packet in packets if len(packet) > 0]
+
+#the waveform pycomm would send for these bytes
+def bytePacket(data, commType, pycomm=None):
+    if commType in ["ic", "xroslink"]:
+        import piosim
+        return piosim.simulate(commType, list(data))[0][1:]
+    if pycomm is None:
+        pycomm = pycommNamespace()
+    class Capture:
+        def send(self, pulses):
+            pass
+    params = pycomm["Params"](pycomm["TYPE_" + commType.upper()])
+    return list(pycomm["sendPacketModulated"](Capture(), params, data))
+
+def pycommNamespace():
+    import commsim
+    code = commsim.loadCode()
+    return commsim.Device(commsim.Simulation(code), "", code).namespace
+
+#spec with its packets as lists of durations
+def expandSequence(spec, records, pycomm):
+    spec = dict(spec)
+    if "pycomm" in spec:
+        sequence = pycomm[spec["pycomm"]]
+        commType = PYCOMM_TYPES[sequence[0]]
+        spec.setdefault("modulated", commType in ["datalink", "fusion"])
+        spec.setdefault("goFirst", sequence[1])
+        spec.setdefault("packets", [{"bytes": packet, "type": commType} for packet in sequence[2:]])
+    spec.setdefault("replyDelay", REPLY_DELAYS[spec["modulated"]])
+    packets = []
+    for packet in spec["packets"]:
+        if isinstance(packet, list):
+            packets.append(packet)
+        elif "bytes" in packet:
+            packets.append(bytePacket(packet["bytes"], packet["type"], pycomm))
+        else:
+            fromRecord = recordPackets(records[packet["record"]], packet.get("channel", "A"))
+            if "packets" in packet:
+                fromRecord = [fromRecord[i] for i in packet["packets"]]
+            packets.extend(fromRecord)
+    spec["packets"] = packets
+    return spec
+
+def packPacket(durations):
+    packed = packdur.packDur(durations)
+    if (packed >= CALL).any():
+        raise ValueError("duration too long for a sequence table")
+    return tuple(packed.tolist())
+
+#Chooses the shared sub-tables. Returns the sub-tables and, for each sequence,
+#its packets as (sub-table index or None, inline words).
+def share(packetLists):
+    counts = {}
+    for packets in packetLists:
+        for packet in packets:
+            counts[packet] = counts.get(packet, 0) + 1
+    subTables = []
+    whole = {}
+    for packet, count in counts.items():
+        #CALL and index per use, against the sub-table's END
+        if count > 1 and len(packet) + 1 + 2 * count < len(packet) * count:
+            whole[packet] = len(subTables)
+            subTables.append(packet)
+    #the rest may share a prefix: take the prefix that saves most, as long as any does
+    prefixes = {}
+    remaining = sorted(packet for packet in counts if packet not in whole)
+    while True:
+        best = None
+        bestSaving = 0
+        for a, b in zip(remaining, remaining[1:]):
+            length = 0
+            while length < min(len(a), len(b)) and a[length] == b[length]:
+                length += 1
+            length -= length % 2
+            if length < MIN_SHARED:
+                continue
+            prefix = a[:length]
+            users = [p for p in remaining if p[:length] == prefix]
+            uses = sum(counts[p] for p in users)
+            saving = (uses - 1) * length - 1 - 2 * uses
+            if saving > bestSaving:
+                best, bestSaving = (prefix, users), saving
+        if best is None:
+            break
+        prefix, users = best
+        for packet in users:
+            prefixes[packet] = len(subTables)
+        subTables.append(prefix)
+        remaining = [p for p in remaining if p not in prefixes]
+    result = []
+    for packets in packetLists:
+        parts = []
+        for packet in packets:
+            if packet in whole:
+                parts.append((whole[packet], ()))
+            elif packet in prefixes:
+                index = prefixes[packet]
+                parts.append((index, packet[len(subTables[index]):]))
+            else:
+                parts.append((None, packet))
+        result.append(parts)
+    return subTables, result
+
+def headerWords(spec):
+    return [ord(c) for c in spec["description"]] + [packdur.END, int(spec["modulated"]), int(spec["goFirst"]), spec["replyDelay"]]
+
+#sizes in bytes: as one flat table each, and with the shared sub-tables
+#(each sequence is charged its share of the sub-tables it uses)
+def footprint(specs, packetLists, subTables, parts):
+    users = [set() for _ in subTables]
+    for i, sequenceParts in enumerate(parts):
+        for index, _ in sequenceParts:
+            if index is not None:
+                users[index].add(i)
+    report = []
+    for i, (spec, packets, sequenceParts) in enumerate(zip(specs, packetLists, parts)):
+        header = len(headerWords(spec)) + 1
+        flat = header + sum(len(p) + 1 for p in packets)
+        own = header + sum(len(inline) + 1 + (2 if index is not None else 0) for index, inline in sequenceParts)
+        shared = sum((len(subTables[index]) + 2) / len(users[index]) for index in set(index for index, _ in sequenceParts if index is not None))
+        report.append((spec["name"], flat * 2, own * 2, shared * 2))
+    return report
+
+def cValue(value):
+    if value == packdur.END:
+        return "END"
+    if value == packdur.WAIT:
+        return "WAIT"
+    if value == CALL:
+        return "CALL"
+    if value >= packdur.RAW_LIMIT:
+        return "0x%04X" % value
+    return str(value)
+
+def cArray(name, values, header=None):
+    lines = []
+    for i in range(0, len(values), VALUES_PER_LINE):
+        lines.append("    " + ",".join(values[i:i+VALUES_PER_LINE]) + ",")
+    if header is None:
+        start = "const uint16_t %s[] PROGMEM = {" % name
+    else:
+        start = "const uint16_t %s[] PROGMEM = {%s" % (name, header)
+    if values == ["END"]:
+        return start + " END};\n"
+    return start + "\n" + "\n".join(lines)[:-1] + "};\n"
+
+def emit(specs, subTables, parts, sourceName):
+    out = ["/* This file is part of the DMComm project by BladeSabre. License: MIT. */\n",
+        "/* Generated by seqcompile.py from %s ; edit that and run it again. */\n" % sourceName]
+    for i, table in enumerate(subTables):
+        out.append(cArray("shared%d" % i, [cValue(v) for v in table] + ["END"]))
+    out.append("const uint16_t * const subTables[] PROGMEM = {\n%s\n};\n" % "\n".join("    shared%d," % i for i in range(len(subTables))) if len(subTables) > 0
+        else "const uint16_t * const subTables[] PROGMEM = {nullptr};\n")
+    for spec, sequenceParts in zip(specs, parts):
+        header = ",".join("'%s'" % c for c in spec["description"]) + ",END, %s,%s,%d," % (
+            "true" if spec["modulated"] else "false", "true" if spec["goFirst"] else "false", spec["replyDelay"])
+        values = []
+        for index, inline in sequenceParts:
+            if index is not None:
+                values.extend(["CALL", str(index)])
+            values.extend(cValue(v) for v in inline)
+            values.append("WAIT")
+        values.append("END")
+        out.append(cArray(spec["name"], values, header))
+    out.append("const uint16_t * const sequences[] PROGMEM = {\n%s\n};\n" % "\n".join("    %s," % spec["name"] for spec in specs))
+    return "\n".join(out)
+
+def compileFile(path, corpusPaths=None):
+    with open(path) as f:
+        specs = json.load(f)["sequences"]
+    records = {}
+    if any(isinstance(p, dict) and "record" in p for spec in specs for p in spec.get("packets", [])):
+        for corpusPath in corpusPaths or [corpus.CORPUS_PATH]:
+            for item in corpus.openCorpus(corpusPath).records():
+                records.setdefault(item["id"], item)
+    pycomm = pycommNamespace() if any("pycomm" in spec or any(isinstance(p, dict) and "bytes" in p for p in spec.get("packets", [])) for spec in specs) else None
+    specs = [expandSequence(spec, records, pycomm) for spec in specs]
+    packetLists = [[packPacket(p) for p in spec["packets"]] for spec in specs]
+    subTables, parts = share(packetLists)
+    return specs, packetLists, subTables, parts
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Compile sequences into ircomm's PROGMEM tables.")
+    argParser.add_argument("spec", nargs="?", default="ircomm/sequences.json")
+    argParser.add_argument("--output", default="ircomm/sequencetables.h")
+    argParser.add_argument("--corpus", action="append", help="where records named in the spec are (default irdata.json)")
+    args = argParser.parse_args()
+    specs, packetLists, subTables, parts = compileFile(args.spec, args.corpus)
+    corpus.writeAtomic(args.output, emit(specs, subTables, parts, os.path.basename(args.spec)))
+    print("sequence", "flat", "own", "shared", "total", sep="\t")
+    totals = [0, 0]
+    for name, flat, own, shared in footprint(specs, packetLists, subTables, parts):
+        print(name, flat, own, "%.0f" % shared, "%.0f" % (own + shared), sep="\t")
+        totals[0] += flat
+        totals[1] += own + shared
+    print("bytes of flash: %d as flat tables, %.0f compiled, %d sub-tables" % (totals[0], totals[1], len(subTables)), file=sys.stderr)
@@ -0,0 +1,175 @@
+import argparse, hashlib, io, json, os, sys, time, zlib
+import numpy as np
+
+import corpus
+import decode_ic
+import decode_witches
+import dedupe
+import timeline
+
+#Nearest-neighbour search over the corpus: "which records look most like this
+#capture". Each record becomes two small feature vectors:
+#  timing   histograms of log-quantized intervals and packet lengths per channel
+#  decoded  decoded packets and pairs of consecutive packets, hashed into buckets
+#Vectors are kept in one array per kind, so a query is a single vectorized
+#distance computation over all records.
+#The vectors are cached next to the corpus and checked against the corpus
+#version, like irtool.py's metadata; when it has changed, records whose content
+#is the same keep their vectors, and records no longer in the corpus are dropped.
+
+HISTOGRAM_BINS = 40         #intervals from 2**2 to 2**22 us, two bins per octave
+PACKET_BINS = 12            #packet lengths from 1 to 2**12 intervals, one bin per doubling
+DECODED_SIZE = 256          #hashed decoded-packet features
+FEATURE_VERSION = 2
+
+def timingFeatures(item):
+    parts = []
+    for channel in ["A", "B"]:
+        #on and off times kept apart where the record has them, as in dedupe.py
+        durations = dedupe.channelDurations(item, channel)
+        bins = np.clip((np.log2(np.maximum(np.asarray(durations[1:], dtype=np.float64), 1)) * 2).astype(np.int64) - 4, 0, HISTOGRAM_BINS - 1)
+        histogram = np.bincount(bins, minlength=HISTOGRAM_BINS).astype(np.float32)
+        lengths = [len(packet) for packet in dedupe.packets(durations)]
+        lengthBins = np.clip(np.log2(np.maximum(lengths, 1)).astype(np.int64), 0, PACKET_BINS - 1)
+        lengthHistogram = np.bincount(lengthBins, minlength=PACKET_BINS).astype(np.float32)
+        #shapes, not counts: a longer capture of the same exchange should stay close
+        parts.append(histogram / max(histogram.sum(), 1))
+        parts.append(lengthHistogram / max(lengthHistogram.sum(), 1))
+    return np.concatenate(parts)
+
+#decoded packets per channel, or None when there is no decoder for the record
+def decodedPackets(item):
+    if item.get("decode") in ["ic", "ics"]:
+        channels = []
+        for channel in ["A", "B"]:
+            if channel in item:
+                durations = timeline.recordIntervals(item, channel)
+                _, decoder2 = decode_ic.decodeChannel(durations, tick=decode_ic.estimateTick(durations))
+                channels.append(["%04X" % data for _, data, _, status, _ in decoder2.packets if status <= decode_ic.STATUS_AUTOFIX])
+        return channels
+    if item.get("decode") == "witches":
+        return [["%02X" % b for b in decode_witches.decode(item["A"][1:])]]
+    return None
+
+def decodedFeatures(item):
+    vector = np.zeros(DECODED_SIZE, dtype=np.float32)
+    channels = decodedPackets(item)
+    if channels is None:
+        return vector
+    for channelNum, packets in enumerate(channels):
+        tokens = ["%d %s" % (channelNum, p) for p in packets]
+        tokens += ["%d %s>%s" % (channelNum, a, b) for a, b in zip(packets, packets[1:])]
+        for token in tokens:
+            vector[zlib.crc32(token.encode()) % DECODED_SIZE] += 1
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+FEATURES = {"timing": timingFeatures, "decoded": decodedFeatures}
+
+def recordKey(item):
+    return hashlib.sha1(json.dumps(item, sort_keys=True).encode()).hexdigest()
+
+#Feature arrays grow by doubling, so add() is amortized constant time.
+class SimilarityIndex:
+    def __init__(self):
+        self.ids = []
+        self.keys = []
+        self.positions = {}
+        self.arrays = {kind: np.zeros((64, len(f({"id": "", "A": []}))), dtype=np.float32) for kind, f in FEATURES.items()}
+    def __len__(self):
+        return len(self.ids)
+    #vectors are copied from previous (an older index) if it has the record unchanged
+    def add(self, item, previous=None):
+        if item["id"] in self.positions:
+            return
+        key = recordKey(item)
+        n = len(self.ids)
+        old = previous.positions.get(item["id"]) if previous is not None else None
+        if old is not None and previous.keys[old] != key:
+            old = None
+        for kind, f in FEATURES.items():
+            if n == len(self.arrays[kind]):
+                self.arrays[kind] = np.concatenate([self.arrays[kind], np.zeros_like(self.arrays[kind])])
+            self.arrays[kind][n] = f(item) if old is None else previous.arrays[kind][old]
+        self.positions[item["id"]] = n
+        self.ids.append(item["id"])
+        self.keys.append(key)
+    #k nearest records as (id, distance), nearest first
+    def query(self, item, k=5, kind="timing", exclude=()):
+        n = len(self.ids)
+        if n == 0:
+            return []
+        vectors = self.arrays[kind][:n]
+        distances = np.sqrt(((vectors - FEATURES[kind](item)) ** 2).sum(axis=1))
+        if kind == "decoded":
+            #records without decodings aren't comparable
+            distances[~vectors.any(axis=1)] = np.inf
+        for itemId in exclude:
+            if itemId in self.positions:
+                distances[self.positions[itemId]] = np.inf
+        k = min(k, n)
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(self.ids[i], float(distances[i])) for i in nearest if np.isfinite(distances[i])]
+    def save(self, path, version):
+        n = len(self.ids)
+        buffer = io.BytesIO()
+        np.savez(buffer, version=np.array(version, dtype=np.int64), ids=np.array(self.ids, dtype=str),
+            keys=np.array(self.keys, dtype=str), **{kind: array[:n] for kind, array in self.arrays.items()})
+        corpus.writeCache(path, buffer.getvalue())
+    #(index, corpus version it was built from); an empty index if the features have changed since
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            version = data["version"].tolist()
+            if version[0] != FEATURE_VERSION:
+                return index, None
+            index.ids = data["ids"].tolist()
+            index.keys = data["keys"].tolist()
+            index.positions = {itemId: i for i, itemId in enumerate(index.ids)}
+            for kind in FEATURES:
+                index.arrays[kind] = np.concatenate([data[kind], np.zeros_like(data[kind][:64])])
+        return index, version
+
+#index of a corpus, cached next to it (or in cachePath) and rebuilt when the corpus changes
+def openIndex(corpusPath=corpus.CORPUS_PATH, cachePath=None):
+    if cachePath is None:
+        cachePath = corpus.sidecarPath(corpusPath, "similar.npz")
+    version = corpus.corpusVersion(corpusPath, FEATURE_VERSION)
+    previous = None
+    try:
+        previous, cachedVersion = SimilarityIndex.load(cachePath)
+        if cachedVersion == version:
+            return previous
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    index = SimilarityIndex()
+    for item in corpus.openCorpus(corpusPath).records():
+        if "A" in item:
+            index.add(item, previous)
+    index.save(cachePath, version)
+    return index
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Find the records most like a given one.")
+    argParser.add_argument("query", help="id of a corpus record, or a JSON file holding a record")
+    argParser.add_argument("--corpus", default=corpus.CORPUS_PATH)
+    argParser.add_argument("--index", help="cache of record features (default next to the corpus)")
+    argParser.add_argument("-k", type=int, default=5)
+    argParser.add_argument("--by", choices=list(FEATURES), default="timing")
+    args = argParser.parse_args()
+    index = openIndex(args.corpus, args.index)
+    if os.path.isfile(args.query):
+        with open(args.query) as f:
+            item = json.load(f)
+    else:
+        item = next((item for item in corpus.openCorpus(args.corpus).records() if item["id"] == args.query), None)
+        if item is None:
+            sys.exit("no record " + args.query)
+    timeStart = time.monotonic()
+    results = index.query(item, args.k, args.by, exclude=[item.get("id")])
+    elapsed = time.monotonic() - timeStart
+    for itemId, distance in results:
+        print(itemId, "%.3f" % distance, sep="\t")
+    print("%d records searched in %.4f s" % (len(index), elapsed), file=sys.stderr)
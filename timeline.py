@@ -0,0 +1,194 @@
+import argparse, io, json, os, sys, time
+import numpy as np
+
+import corpus
+
+#Every record as absolute edge times, worked out once and kept next to the
+#corpus, so the plot page and the decoders don't each convert the traces again.
+#Records come in two shapes: with "hasOnTimes" (0, on, off, on, off...) and, as
+#twinscope.ino prints them, intervals between falling edges only. Both become
+#int32 times from the trigger (int64 if a trace is too long for that), one per
+#edge, with the level after each edge (1 for IR on). Falling-edge records only
+#have level 1 edges: their off edges were never captured, and none are made up
+#here (the page draws them as 1us pulses, as insertOnTimes did).
+#The packets of each channel (split at gaps over PACKET_GAP, as selectPacket
+#does) are kept as edge indices, and since the times are sorted, a time range
+#is two binary searches.
+#The cache is rebuilt when the corpus changes, like irtool.py's metadata, and
+#ingest.py extends it as records are appended.
+
+TIMELINE_VERSION = 1
+PACKET_GAP = 15000
+CHANNELS = ["A", "B"]
+
+#(times, levels) of one channel's durations
+def edges(durations, hasOnTimes):
+    times = np.cumsum(np.asarray(durations, dtype=np.int64))
+    levels = np.ones(len(times), dtype=np.int8)
+    if hasOnTimes:
+        levels[1::2] = 0
+    #a trace over 35 minutes stays int64, and so does the column it joins
+    if len(times) > 0 and times.max() > np.iinfo(np.int32).max:
+        return times, levels
+    return times.astype(np.int32), levels
+
+#index of each packet's first edge
+def packetStarts(times):
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int32)
+    return np.r_[0, np.flatnonzero(np.diff(times) > PACKET_GAP) + 1].astype(np.int32)
+
+#edges of packet packetNum (from 1; 0 for all), timed from its first edge
+def packet(times, levels, starts, packetNum):
+    if packetNum == 0:
+        return times, levels
+    if packetNum > len(starts):
+        return times[:0], levels[:0]
+    end = starts[packetNum] if packetNum < len(starts) else len(times)
+    part = slice(starts[packetNum - 1], end)
+    return times[part] - times[part.start], levels[part]
+
+#falling-edge intervals, as the decoders take them
+def intervals(times, levels):
+    on = times[levels == 1].astype(np.int64)
+    if len(on) == 0:
+        return []
+    return [int(on[0])] + np.diff(on).tolist()
+
+#the durations as the record stores them
+def durations(times):
+    if len(times) == 0:
+        return []
+    return [int(times[0])] + np.diff(times.astype(np.int64)).tolist()
+
+#slice of the edges with start <= time < end
+def between(times, start, end):
+    return slice(int(np.searchsorted(times, start)), int(np.searchsorted(times, end)))
+
+#falling-edge intervals of one channel of a record, which may not have the timeline yet
+def recordIntervals(item, channel):
+    return intervals(*edges(item.get(channel, []), item.get("hasOnTimes", False)))
+
+#Columns for all records: lengths is records x channels with -1 for a missing
+#channel (as in packdur.py), and the edges and packet starts of all channels
+#are concatenated in that order.
+class Timelines:
+    def __init__(self, ids, lengths, times, levels, packetCounts, packets):
+        self.ids = np.asarray(ids, dtype=str)
+        self.lengths = lengths
+        self.times = times
+        self.levels = levels
+        self.packetCounts = packetCounts
+        self.packets = packets
+        self.offsets = np.r_[0, np.cumsum(np.maximum(lengths, 0).reshape(-1))]
+        self.packetOffsets = np.r_[0, np.cumsum(packetCounts.reshape(-1))]
+    def __len__(self):
+        return len(self.ids)
+    @classmethod
+    def fromRecords(cls, items):
+        ids = []
+        lengths = []
+        packetCounts = []
+        columns = []
+        for item in items:
+            ids.append(item["id"])
+            for channel in CHANNELS:
+                if channel in item:
+                    times, levels = edges(item[channel], item.get("hasOnTimes", False))
+                    starts = packetStarts(times)
+                    columns.append((times, levels, starts))
+                    lengths.append(len(times))
+                    packetCounts.append(len(starts))
+                else:
+                    lengths.append(-1)
+                    packetCounts.append(0)
+        def joined(i, dtype):
+            return np.concatenate([c[i] for c in columns]) if len(columns) > 0 else np.zeros(0, dtype=dtype)
+        return cls(ids, np.array(lengths, dtype=np.int32).reshape(-1, 2), joined(0, np.int32), joined(1, np.int8),
+            np.array(packetCounts, dtype=np.int32).reshape(-1, 2), joined(2, np.int32))
+    def has(self, record, channel):
+        return self.lengths[record, CHANNELS.index(channel)] >= 0
+    #(times, levels) of one channel; empty if the record doesn't have it
+    def channel(self, record, channel):
+        i = record * 2 + CHANNELS.index(channel)
+        return self.times[self.offsets[i]:self.offsets[i+1]], self.levels[self.offsets[i]:self.offsets[i+1]]
+    def packetStarts(self, record, channel):
+        i = record * 2 + CHANNELS.index(channel)
+        return self.packets[self.packetOffsets[i]:self.packetOffsets[i+1]]
+    def packet(self, record, channel, packetNum):
+        return packet(*self.channel(record, channel), self.packetStarts(record, channel), packetNum)
+    def intervals(self, record, channel):
+        return intervals(*self.channel(record, channel))
+    def extend(self, other):
+        return Timelines(np.r_[self.ids, other.ids], np.concatenate([self.lengths, other.lengths]),
+            np.r_[self.times, other.times], np.r_[self.levels, other.levels],
+            np.concatenate([self.packetCounts, other.packetCounts]), np.r_[self.packets, other.packets])
+    #one record as the plot page takes it
+    def jsonRecord(self, record):
+        result = {"id": str(self.ids[record])}
+        for channel in CHANNELS:
+            if self.has(record, channel):
+                times, levels = self.channel(record, channel)
+                result[channel] = {"times": times.tolist(), "levels": levels.tolist(),
+                    "packets": self.packetStarts(record, channel).tolist()}
+        return result
+    def jsonText(self):
+        return "{\"data\": [\n" + ",\n".join(json.dumps(self.jsonRecord(r), separators=(",", ":")) for r in range(len(self))) + "\n]}\n"
+    def save(self, path, version):
+        buffer = io.BytesIO()
+        np.savez(buffer, version=np.array(version, dtype=np.int64), ids=self.ids, lengths=self.lengths, times=self.times,
+            levels=self.levels, packetCounts=self.packetCounts, packets=self.packets)
+        corpus.writeCache(path, buffer.getvalue())
+    #(timelines, version)
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            timelines = cls(data["ids"], data["lengths"], data["times"], data["levels"], data["packetCounts"], data["packets"])
+            return timelines, data["version"].tolist()
+
+def cachePath(path):
+    return corpus.sidecarPath(path, "timeline.npz")
+
+def corpusVersion(path):
+    return corpus.corpusVersion(path, TIMELINE_VERSION)
+
+def cached(path):
+    try:
+        return Timelines.load(cachePath(path))
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+#the corpus's timelines, from the cache if it is up to date
+def load(path=corpus.CORPUS_PATH):
+    version = corpusVersion(path)
+    timelines, cachedVersion = cached(path)
+    if cachedVersion == version:
+        return timelines
+    timelines = Timelines.fromRecords(corpus.openCorpus(path).records())
+    timelines.save(cachePath(path), version)
+    return timelines
+
+#After items were appended to the corpus, whose version before was "before":
+#add them to the cache if it was up to date, instead of converting everything
+#again on the next load. A store's manifest also has to agree on the count, in
+#case another writer appended in between.
+def extend(path, items, before):
+    timelines, cachedVersion = cached(path)
+    if cachedVersion != before:
+        return
+    if os.path.isdir(path):
+        count = sum(segment["count"] for segment in corpus.SegmentStore(path).segments())
+        if count != len(timelines) + len(items):
+            return
+    timelines.extend(Timelines.fromRecords(items)).save(cachePath(path), corpusVersion(path))
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Build the edge timeline cache of a corpus.")
+    argParser.add_argument("corpus", nargs="?", default=corpus.CORPUS_PATH)
+    argParser.add_argument("--json", metavar="OUT", help="also write the timelines for the plot page (irtimeline.json)")
+    args = argParser.parse_args()
+    timeStart = time.monotonic()
+    timelines = load(args.corpus)
+    print("%d records, %d edges, %d packets in %.3f s" % (len(timelines), len(timelines.times), len(timelines.packets), time.monotonic() - timeStart), file=sys.stderr)
+    if args.json is not None:
+        corpus.writeAtomic(args.json, timelines.jsonText())
@@ -0,0 +1,190 @@
+import difflib, json, os, re, sys, time
+
+import corpus
+import decode_ic
+import decode_witches
+import timeline
+
+#Watch the corpus and print what changed in the decodings, for use while
+#editing irdata.json or capturing. Run it as "irtool.py watch".
+#Earlier results are kept in memory: a record is only parsed again if its text
+#changed, and only decoded again if its durations changed, so an update costs
+#about as much as the edit.
+
+RECORD_START = re.compile(r"^\{", re.MULTILINE)
+
+#checked decoding as {channel: [packet, ...]}, or None if there's no decoder
+def decodePackets(item, clean=False, clock=False):
+    decodeType = item.get("decode", "")
+    if decodeType == "witches":
+        return {"A": [" ".join("%02X" % x for x in decode_witches.decode(item["A"][1:]))]}
+    if decodeType not in decode_ic.TICK_PARAMS:
+        return None
+    params = decode_ic.TICK_PARAMS[decodeType]
+    #falling-edge intervals, also for records with on times
+    channels = {channel: timeline.recordIntervals(item, channel) for channel in ["A", "B"] if channel in item}
+    if clean and "B" in item:
+        import crossover
+        channels = crossover.cleanRecord(dict(item, **channels))
+    result = {}
+    for channel in ["A", "B"]:
+        if channel in item:
+            tick = decode_ic.estimateTick(channels[channel], params) if clock else None
+            decoder, decoder2 = decode_ic.decodeChannel(channels[channel], params, tick)
+            if decoder2 is None:
+                #no iC packet framing: one entry per packet of bytes
+                result[channel] = decoder.getHex().split(" ..... ")
+            else:
+                result[channel] = decoder2.result
+    return result
+
+def packetStatus(packet):
+    if packet.startswith("?"):
+        return "unreadable"
+    if packet.startswith(("chkfail", "error")):
+        return packet.split()[0]
+    if "autofix" in packet:
+        return "autofix"
+    return "ok"
+
+#lines describing the differences between two decodings of one channel
+def diffPackets(old, new):
+    lines = []
+    matcher = difflib.SequenceMatcher(a=old, b=new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if tag == "replace" and i2 - i1 == j2 - j1:
+            for k in range(i2 - i1):
+                before, after = old[i1 + k], new[j1 + k]
+                status = ""
+                if packetStatus(before) != packetStatus(after):
+                    status = " (%s -> %s)" % (packetStatus(before), packetStatus(after))
+                lines.append("packet %d: %s -> %s%s" % (j1 + k + 1, before, after, status))
+            continue
+        for k in range(i1, i2):
+            lines.append("packet %d removed: %s" % (k + 1, old[k]))
+        for k in range(j1, j2):
+            lines.append("packet %d new: %s" % (k + 1, new[k]))
+    return lines
+
+#Records of a corpus, reusing the parse of each record whose text is unchanged
+#(irdata.json) or of each segment already seen (segment store).
+class RecordCache:
+    def __init__(self):
+        self.blocks = {}
+        self.segments = {}
+    def read(self, path):
+        if os.path.isdir(path):
+            store = corpus.SegmentStore(path)
+            segments = {}
+            records = []
+            for segment in store.segments():
+                name = segment["name"]
+                if name not in self.segments:
+                    with open(store.segmentPath(name)) as f:
+                        self.segments[name] = json.load(f)["data"]
+                segments[name] = self.segments[name]
+                records.extend(segments[name])
+            self.segments = segments
+            return records
+        with open(path) as f:
+            text = f.read()
+        starts = [m.start() for m in RECORD_START.finditer(text)]
+        if len(starts) == 0 or not text[:starts[0]].rstrip().endswith("["):
+            #not laid out one record per block; parse the whole file
+            return json.loads(text)["data"]
+        blocks = {}
+        records = []
+        for start, end in zip(starts, starts[1:] + [len(text)]):
+            block = text[start:end].rstrip()
+            if end == len(text):
+                block = block[:-2].rstrip() if block.endswith("]}") else block
+            block = block.rstrip(",")
+            if block not in self.blocks:
+                try:
+                    self.blocks[block] = json.loads(block)
+                except ValueError:
+                    return json.loads(text)["data"]
+            blocks[block] = self.blocks[block]
+            records.append(blocks[block])
+        self.blocks = blocks
+        return records
+
+def contentKey(item):
+    return json.dumps([item.get("decode"), item.get("A"), item.get("B")])
+
+class Watcher:
+    def __init__(self, paths, clean=False, select=None, clock=False):
+        self.paths = paths
+        self.clean = clean
+        self.clock = clock
+        self.select = select
+        self.caches = {path: RecordCache() for path in paths}
+        self.versions = {}
+        self.results = {}
+    def version(self, path):
+        try:
+            return corpus.corpusVersion(path)
+        except FileNotFoundError:
+            return None
+    def changed(self):
+        return any(self.version(path) != self.versions.get(path) for path in self.paths)
+    #read the corpus again and return the lines describing what changed
+    def update(self):
+        records = []
+        for path in self.paths:
+            self.versions[path] = self.version(path)
+            try:
+                records.extend(self.caches[path].read(path))
+            except (OSError, ValueError) as e:
+                #mid-edit; try again at the next change
+                return ["%s: %s" % (path, e)]
+        lines = []
+        results = {}
+        for item in records:
+            if "A" not in item or "id" not in item or (self.select is not None and not self.select(item)):
+                continue
+            itemId = item["id"]
+            if itemId in results:
+                continue
+            previous = self.results.get(itemId)
+            #an unchanged block gives back the very same object
+            if previous is not None and previous[2] is item:
+                results[itemId] = previous
+                continue
+            key = contentKey(item)
+            if previous is not None and previous[0] == key:
+                results[itemId] = (key, previous[1], item)
+                continue
+            decoded = decodePackets(item, self.clean, self.clock)
+            results[itemId] = (key, decoded, item)
+            if decoded is None:
+                continue
+            if previous is None or previous[1] is None:
+                for channel, packets in decoded.items():
+                    lines.append("+ %s\t%s:\t%s" % (itemId, channel, "\t".join(packets)))
+                continue
+            for channel in sorted(set(previous[1]) | set(decoded)):
+                for line in diffPackets(previous[1].get(channel, []), decoded.get(channel, [])):
+                    lines.append("~ %s\t%s:\t%s" % (itemId, channel, line))
+        for itemId, (key, decoded, _) in self.results.items():
+            if itemId not in results and decoded is not None:
+                lines.append("- %s" % itemId)
+        self.results = results
+        return lines
+    def run(self, interval, output=sys.stdout):
+        first = True
+        while True:
+            if self.changed():
+                timeStart = time.monotonic()
+                lines = self.update()
+                if first:
+                    print("%d records decoded" % sum(1 for _, d, _ in self.results.values() if d is not None), file=output)
+                    first = False
+                else:
+                    for line in lines:
+                        print(line, file=output)
+                    print("-- %s, %d changes in %.3f s" % (time.strftime("%H:%M:%S"), len(lines), time.monotonic() - timeStart), file=output)
+                output.flush()
+            time.sleep(interval)